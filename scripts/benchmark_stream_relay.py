@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Compares the per-request cost of relaying an SLM token stream to a slow client:
+#   thread+queue: a threading.Thread (a greenlet under monkey patching) pushes every line
+#                 into an unbounded Queue that the response generator drains
+#   direct:       the response generator yields straight from the upstream iterator
+#
+# Reports the peak Python memory allocated and the number of greenlet switches per request.
+# Run from the repository root: python3 scripts/benchmark_stream_relay.py
+import gevent.monkey
+
+gevent.monkey.patch_all()
+
+import argparse
+import json
+import os
+import sys
+import threading
+import tracemalloc
+from queue import Queue
+
+import gevent
+import greenlet
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from common.StreamRelay import relay_lines  # noqa: E402
+
+
+class FakeResponse:
+    """Upstream completion stream that produces SSE token lines in network-sized chunks."""
+
+    def __init__(self, tokens, chunk_size, delay):
+        lines = [
+            "data: "
+            + json.dumps(
+                {"content": f" token{i}", "stop": False}, separators=(",", ":")
+            )
+            + "\n\n"
+            for i in range(tokens)
+        ]
+        lines.append('data: {"content":"","stop":true}\n\n')
+        self.body = "".join(lines).encode("utf-8")
+        self.chunk_size = chunk_size
+        self.delay = delay
+
+    def iter_content(self, chunk_size=None):
+        for start in range(0, len(self.body), self.chunk_size):
+            if self.delay:
+                gevent.sleep(self.delay)
+            yield self.body[start : start + self.chunk_size]
+
+
+def thread_queue_relay(response):
+    def process_stream(queue):
+        try:
+            for line in relay_lines(response):
+                queue.put(line)
+        finally:
+            queue.put(None)
+
+    queue = Queue()
+    thread = threading.Thread(target=process_stream, args=(queue,))
+    thread.start()
+
+    while True:
+        data = queue.get()
+        if data is None:
+            break
+        yield data
+
+    thread.join()
+
+
+def direct_relay(response):
+    yield from relay_lines(response)
+
+
+def slow_client(stream, delay):
+    """Consumes the stream like a WSGI server writing to a slow socket."""
+    for _ in stream:
+        if delay:
+            gevent.sleep(delay)
+
+
+def measure(relay, tokens, chunk_size, upstream_delay, delay):
+    switches = 0
+
+    def trace(event, args):
+        nonlocal switches
+        if event in ("switch", "throw"):
+            switches += 1
+
+    response = FakeResponse(tokens, chunk_size, upstream_delay)
+
+    tracemalloc.start()
+    previous_trace = greenlet.settrace(trace)
+    try:
+        gevent.spawn(slow_client, relay(response), delay).join()
+    finally:
+        greenlet.settrace(previous_trace)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return peak, switches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument(
+        "--upstream-delay",
+        type=float,
+        default=0.0,
+        help="Seconds the upstream takes per chunk (0 for an upstream that never blocks)",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0002,
+        help="Seconds the client takes per line (0 for a client that never blocks)",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{args.tokens} tokens, {args.chunk_size}-byte upstream chunks every "
+        f"{args.upstream_delay * 1000:.2f} ms, {args.delay * 1000:.2f} ms per line on "
+        f"the client, {args.runs} runs"
+    )
+    print(f"{'relay':<14}{'peak memory (KiB)':>20}{'greenlet switches':>20}")
+
+    for name, relay in (("thread+queue", thread_queue_relay), ("direct", direct_relay)):
+        results = [
+            measure(
+                relay, args.tokens, args.chunk_size, args.upstream_delay, args.delay
+            )
+            for _ in range(args.runs)
+        ]
+        peak = sum(result[0] for result in results) / len(results)
+        switches = sum(result[1] for result in results) / len(results)
+        print(f"{name:<14}{peak / 1024:>20.1f}{switches:>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
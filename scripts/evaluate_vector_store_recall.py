@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Measures the recall and latency of the local IVF vector store against the exact
+# (brute-force) store over the same files, for several numbers of probed lists.
+# Queries are stored embeddings with Gaussian noise added, so they have near neighbours.
+#
+# Run from the src folder: python3 ../scripts/evaluate_vector_store_recall.py
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from common.LocalVectorStore import (  # noqa: E402
+    LocalVectorStore,
+    BruteForceVectorStore,
+    normalize_rows,
+)
+
+
+def search_all(store, queries, limit):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(store.search_similar_texts(query, limit, -1.0))
+        latencies.append(time.perf_counter() - start)
+    return results, np.median(latencies) * 1000
+
+
+def recall(results, expected):
+    found = sum(
+        len({text for text, _ in result} & {text for text, _ in exact})
+        for result, exact in zip(results, expected)
+    )
+    total = sum(len(exact) for exact in expected)
+    return found / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config", default="config.ini")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--probes", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    exact = BruteForceVectorStore(args.config)
+    if not exact.rows:
+        print("The vector store is empty")
+        return
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(
+        np.flatnonzero(exact.alive), size=min(args.queries, len(exact.rows))
+    )
+    queries = normalize_rows(np.asarray(exact.matrix[rows]))
+    queries = normalize_rows(
+        queries + args.noise * rng.standard_normal(queries.shape).astype(np.float32)
+    )
+
+    expected, exact_ms = search_all(exact, queries, args.limit)
+    start = time.perf_counter()
+    exact.search_similar_texts_batch(queries, args.limit, -1.0)
+    batch_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    print(f"{len(exact.rows)} chunks, {len(queries)} queries, top {args.limit}")
+    print(f"{'search':<16}{'recall':>10}{'median ms':>12}")
+    print(f"{'exact':<16}{1.0:>10.3f}{exact_ms:>12.3f}")
+    print(f"{'exact (batch)':<16}{1.0:>10.3f}{batch_ms:>12.3f}")
+
+    ivf = LocalVectorStore(args.config)
+    if ivf.lists is None:
+        print(f"Fewer than IVFMinRows ({ivf.IVF_MIN_ROWS}) chunks, no IVF index")
+        return
+
+    for probes in (int(probes) for probes in args.probes.split(",")):
+        ivf.IVF_PROBES = probes
+        results, ivf_ms = search_all(ivf, queries, args.limit)
+        print(
+            f"{f'ivf, {probes} probes':<16}{recall(results, expected):>10.3f}{ivf_ms:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
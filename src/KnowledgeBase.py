@@ -12,13 +12,19 @@ from botocore.exceptions import ClientError
 from gevent.pywsgi import WSGIServer
 from utils.PDFToJSON import PDFToJSON
 from common.VectorEmbeddings import VectorEmbeddings
-from common.VectorDatabase import VectorDatabase
+from common.VectorStore import create_vector_store
+from common.IngestionPipeline import IngestionPipeline
+from common.TextChunker import TextChunker
+from common.IngestionJobs import IngestionJobManager
+from common.Metrics import REGISTRY, CONTENT_TYPE
+import gevent
 import configparser
 import sys
 import json
-from typing import List
+import hashlib
 import logging
 import os
+import tempfile
 from flask_wtf.csrf import CSRFProtect
 
 
@@ -68,97 +74,31 @@ app.config["MAX_CONTENT_LENGTH"] = config.getint("KnowledgeBase", "PDFMaxSize")
 BUCKET_NAME = config.get("KnowledgeBase", "BucketName")
 REGION_NAME = config.get("KnowledgeBase", "RegionName")
 PORT = config.getint("KnowledgeBase", "Port")
-CHUNK_SIZE = config.getint("KnowledgeBase", "ChunkSize")
+CHUNK_TOKENS = config.getint("KnowledgeBase", "ChunkTokens")
 OVERLAP = config.getfloat("KnowledgeBase", "Overlap")
 SAVEFILETOS3 = config.getboolean("KnowledgeBase", "SavePDFFileToS3")
+INSERT_BATCH_SIZE = config.getint("KnowledgeBase", "InsertBatchSize")
+EMBEDDING_BATCH_SIZE = config.getint("KnowledgeBase", "EmbeddingBatchSize")
+PIPELINE_QUEUE_SIZE = config.getint("KnowledgeBase", "PipelineQueueSize")
+MAX_CONCURRENT_INGESTIONS = config.getint("KnowledgeBase", "MaxConcurrentIngestions")
+JOB_HISTORY_SIZE = config.getint("KnowledgeBase", "JobHistorySize")
+JOB_PROGRESS_INTERVAL = config.getfloat("KnowledgeBase", "JobProgressInterval")
+SAVE_JSON = config.getboolean("KnowledgeBase", "SaveJSON")
+JSON_FOLDER = config.get("KnowledgeBase", "JSONFolder")
+
+# Create the folder of the JSON side artifacts if they are saved
+if SAVE_JSON and not os.path.isdir(JSON_FOLDER):
+    os.mkdir(JSON_FOLDER)
 
 vector_embeddings = VectorEmbeddings(config_file_name)
-vector_database = VectorDatabase(config_file_name)
-
-
-def read_and_concatenate_text(json_data):
-    try:
-        # Check if the required structure exists
-        if not isinstance(json_data, dict) or "pages" not in json_data:
-            error_message = "Invalid JSON structure: 'pages' key not found"
-            logger.error(error_message)
-            raise ValueError(error_message)
-
-        # Initialize empty string for concatenated text
-        concatenated_text = ""
-
-        # Iterate through all pages and concatenate full_text
-        for page_num in sorted(json_data["pages"].keys(), key=int):
-            page = json_data["pages"][page_num]
-            if "full_text" in page:
-                concatenated_text += page["full_text"] + "\n"
-            else:
-                message = f"Warning: 'full_text' not found in page {page_num}"
-                print(message)
-                logger.error(message)
-
-        return concatenated_text.strip()
-
-    except FileNotFoundError as fnfe:
-        error_message = f"Error: {str(fnfe)} File not found"
-        logger.error(error_message)
-        print(error_message)
-        return None
-    except json.JSONDecodeError as jdc:
-        error_message = f"Error: {str(jdc)} Invalid JSON format in file"
-        logger.error(error_message)
-        print(error_message)
-        return None
-    except Exception as e:
-        error_message = f"Error: An unexpected error occurred: {str(e)}"
-        logger.error(error_message)
-        print(error_message)
-        return None
-
-
-def create_chunks(text: str, chunk_size: int = 1024, overlap: float = 0.1) -> List[str]:
-    """
-    Splits text into chunks of specified size with overlap.
-
-    Args:
-        text (str): Text to be split into chunks
-        chunk_size (int): Size of each chunk in characters
-        overlap (float): Overlap percentage between chunks (0.0 to 1.0)
-
-    Returns:
-        List[str]: List of text chunks
-    """
-    if not text:
-        return []
-
-    # Calculate overlap size in characters
-    overlap_size = int(chunk_size * overlap)
-
-    # Initialize variables
-    chunks = []
-    start_pos = 0
-    text_length = len(text)
-
-    while start_pos < text_length:
-        # Calculate end position for current chunk
-        end_pos = start_pos + chunk_size
-
-        # If this is not the last chunk, try to break at a space
-        if end_pos < text_length:
-            # Look for the last space within the chunk
-            space_pos = text[start_pos:end_pos].rfind(" ")
-            if space_pos != -1:
-                end_pos = start_pos + space_pos
-
-        # Extract the chunk
-        chunk = text[start_pos:end_pos].strip()
-        if chunk:  # Only add non-empty chunks
-            chunks.append(chunk)
-
-        # Calculate next start position considering overlap
-        start_pos = end_pos - overlap_size if end_pos < text_length else text_length
-
-    return chunks
+vector_database = create_vector_store(config_file_name)
+# Chunks are measured with the tokenizer of the embeddings model
+text_chunker = TextChunker(
+    vector_embeddings.count_tokens, chunk_tokens=CHUNK_TOKENS, overlap=OVERLAP
+)
+ingestion_jobs = IngestionJobManager(
+    max_concurrent=MAX_CONCURRENT_INGESTIONS, history_size=JOB_HISTORY_SIZE
+)
 
 
 def upload_to_outposts(file_path, bucket_name, object_name, region):
@@ -196,14 +136,31 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() == "pdf"
 
 
-def convert_pdf_to_json(folder_path):
-    converter = PDFToJSON(folder_path, folder_path)
-    json_data = converter.convert_pdf_to_json(folder_path)
+def hash_file(file_path, block_size=1048576):
+    """
+    Returns the SHA-256 content hash of a file, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
-    if json_data:
-        converter.save_json(json_data, folder_path)
+def extract_page_texts(file_path, json_path=None):
+    """
+    Yields the number and text of each page of the PDF as it is parsed, optionally
+    writing the JSON side artifact page by page as well
+    """
+    converter = PDFToJSON(file_path, file_path)
 
-    return json_data
+    for page_num, page in converter.iter_pages(file_path, json_path):
+        if "full_text" in page:
+            yield page_num, page["full_text"]
+        else:
+            message = f"Warning: 'full_text' not found in page {page_num}"
+            print(message)
+            logger.error(message)
 
 
 @app.route("/")
@@ -211,6 +168,81 @@ def index():
     return render_template("knowledgebase.html")
 
 
+def ingest_document(job, temp_file_path, filename):
+    """
+    Background ingestion job: uploads the file to S3, then parses, chunks, embeds and
+    stores it, removing the temporary file when done
+    """
+    try:
+        # Configuration
+        config = {
+            "file_path": temp_file_path,
+            "bucket_name": BUCKET_NAME,
+            "object_name": filename,
+            "region": REGION_NAME,
+        }
+
+        # 1. Upload the file to S3 in the background while the PDF is being ingested
+        s3_upload = None
+        if SAVEFILETOS3:
+            print(f"Saving {filename} file to S3 on Outposts")
+            s3_upload = gevent.spawn(upload_to_outposts, **config)
+
+        # 2. Skip documents that are already stored unchanged
+        document_hash = hash_file(temp_file_path)
+        if vector_database.document_exists(document_hash):
+            print(f"{filename} is already in the knowledge base, skipping it")
+            if s3_upload is not None:
+                s3_upload.join()
+            return "File already in the knowledge base"
+
+        # 3. Parse the pages, chunk them, embed the chunks and store them in the RDS
+        # database (pgvector), with all the stages running at the same time. Chunks that
+        # a previous version of the document already stored are not embedded again.
+        # Pages are processed as they are parsed and never all held in memory; the
+        # optional JSON side artifact is written page by page as well.
+        print(f"Ingesting {filename}")
+        json_path = None
+        if SAVE_JSON:
+            json_path = os.path.join(JSON_FOLDER, f"{filename[:-4]}.json")
+        job.pipeline = IngestionPipeline(
+            vector_embeddings,
+            vector_database,
+            embedding_batch_size=EMBEDDING_BATCH_SIZE,
+            insert_batch_size=INSERT_BATCH_SIZE,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            source=filename,
+            existing_chunk_hashes=vector_database.get_chunk_hashes(filename),
+        )
+        stats = job.pipeline.run(
+            extract_page_texts(temp_file_path, json_path),
+            text_chunker.chunks,
+        )
+        print(f"Ingestion statistics: {stats}")
+
+        # 4. Tag the current chunks with the document hash and drop the stale ones
+        deleted_rows = vector_database.finalize_document(
+            filename, document_hash, job.pipeline.chunk_hashes
+        )
+        print(f"Removed {deleted_rows} chunks of previous versions of {filename}")
+
+        if s3_upload is not None:
+            s3_upload.join()
+
+        print("Upload completed successfully")
+        return "File uploaded successfully"
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise
+
+    finally:
+        # Clean up - remove temporary file
+        print(f"Removing temporary file")
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
     print("Starting the upload...")
@@ -228,68 +260,66 @@ def upload_file():
 
     filename = secure_filename(file.filename)
 
-    # Create a temporary file
-    import tempfile
-    import os
-
-    temp_dir = tempfile.gettempdir()
-    temp_file_path = os.path.join(temp_dir, filename)
+    # Create a temporary file, unique so that concurrent uploads of the same file do not clash
+    temp_fd, temp_file_path = tempfile.mkstemp(suffix=f"_{filename}")
+    os.close(temp_fd)
 
     try:
         # Save the uploaded file temporarily
         file.save(temp_file_path)
 
-        # Configuration
-        config = {
-            "file_path": temp_file_path,
-            "bucket_name": BUCKET_NAME,
-            "object_name": filename,
-            "region": REGION_NAME,
-        }
+        # The ingestion runs in the background; the client polls /jobs/<job_id> for progress
+        job = ingestion_jobs.submit(filename, ingest_document, temp_file_path, filename)
 
-        # 1. Upload file
-        if SAVEFILETOS3:
-            print(f"Saving {filename} file to S3 on Outposts")
-            success = upload_to_outposts(**config)
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "job_id": job.job_id,
+                    "message": "File received, ingestion started",
+                }
+            ),
+            202,
+        )
 
-        # 2. Convert PDF to JSON
-        print(f"Converting {filename} PDF to JSON")
-        json_data = convert_pdf_to_json(temp_file_path)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        # Clean up in case of error
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        return jsonify({"success": False, "message": f"An error occurred: {str(e)}"})
 
-        # 3. Read and concatenate the text
-        full_text = read_and_concatenate_text(json_data)
 
-        # 4. Create chunks of the full_text and store than in the RDS database (pgvector)
-        if full_text:
-            chunks = create_chunks(full_text, chunk_size=CHUNK_SIZE, overlap=OVERLAP)
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
 
-            # Print the chunks
-            print(f"Text split into {len(chunks)} chunks:")
-            print("-" * 50)
+    return jsonify({"success": True, "job": job.to_dict()})
 
-            for i, chunk in enumerate(chunks, 1):
-                print(f"\nChunk {i}:")
-                print("-" * 20)
-                print(chunk)
-                print(f"Length: {len(chunk)} characters")
-                print("-" * 20)
-                vec_embeddings = vector_embeddings.get_vector_embeddings(chunk)
-                print(vec_embeddings)
-                vector_database.insert_text_and_embedding(chunk, vec_embeddings)
 
-        # Clean up - remove temporary file
-        print(f"Removing temporary file")
-        os.remove(temp_file_path)
+@app.route("/jobs/<job_id>/stream", methods=["GET"])
+def job_progress_stream(job_id):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
 
-        print("Upload completed successfully")
-        return jsonify({"success": True, "message": "File uploaded successfully"})
+    # Newline-delimited JSON progress feed, one line per interval until the job is done
+    def generate_progress():
+        while True:
+            yield json.dumps(job.to_dict()) + "\n"
+            if job.done:
+                break
+            gevent.sleep(JOB_PROGRESS_INTERVAL)
 
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        # Clean up in case of error
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-        return jsonify({"success": False, "message": f"An error occurred: {str(e)}"})
+    return app.response_class(generate_progress(), mimetype="application/x-ndjson")
+
+
+# Route exposing latency histograms in the Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 
 if __name__ == "__main__":
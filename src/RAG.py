@@ -8,15 +8,21 @@ import gevent.monkey
 gevent.monkey.patch_all()
 
 # Import required libraries
-from flask import Flask, render_template, request
-import requests
-import json
-import threading
-from queue import Queue
+from flask import Flask, render_template, request, g
 from gevent.pywsgi import WSGIServer
 import numpy as np
 from common.VectorEmbeddings import VectorEmbeddings
-from common.VectorDatabase import VectorDatabase
+from common.VectorStore import create_vector_store
+from common.SemanticCache import SemanticCache
+from common.ContextBuilder import ContextBuilder, TokenCounter
+from common.StreamRelay import stream_completion, error_line, is_stop_line
+from common.HttpSession import get_http_session
+from common.EndpointBalancer import EndpointBalancer, SESSION_ID_HEADER
+from common.PromptTemplate import PromptTemplate
+from common.ConversationSessions import ConversationStore, valid_session_id
+from common.AdmissionControl import AdmissionController, AdmissionRejected
+from common.Metrics import REGISTRY, CONTENT_TYPE
+from common.Tracing import TRACER, REQUEST_ID_HEADER
 import configparser
 import sys
 import logging
@@ -72,10 +78,21 @@ SLM2_MODEL_NAME = config.get("DEFAULT", "SLM2_model_name")
 
 # SLM parameters and endpoints for different models
 MODEL_ENDPOINTS = {
-    SLM1_MODEL_NAME: config.get("DEFAULT", "SLM1_endpoint"),
-    SLM2_MODEL_NAME: config.get("DEFAULT", "SLM2_endpoint"),
+    SLM1_MODEL_NAME: EndpointBalancer.from_config(
+        config, "SLM1_endpoint", SLM1_MODEL_NAME
+    ),
+    SLM2_MODEL_NAME: EndpointBalancer.from_config(
+        config, "SLM2_endpoint", SLM2_MODEL_NAME
+    ),
 }
-INITIAL_PROMPT = config.get("DEFAULT", "Initial_prompt")
+
+# Concurrency limits and wait queues of the models, scaled with their replicas
+ADMISSION_CONTROLLERS = {
+    model: AdmissionController.from_config(config, len(endpoints.endpoints), name=model)
+    for model, endpoints in MODEL_ENDPOINTS.items()
+}
+# Prompts start with the same system prompt so the servers reuse its cached prefix
+PROMPT_TEMPLATE = PromptTemplate.from_config(config)
 
 # Get RAG configuration parameters
 PORT = config.getint("RAG", "Port")
@@ -84,10 +101,62 @@ STREAM_OUTPUT = config.getboolean("RAG", "StreamOutput")
 TIMEOUT = config.getint("RAG", "Timeout")
 SIMILAR_THRESHOLD = config.getfloat("RAG", "SimilarityThreshold")
 LIMIT = config.getint("RAG", "Limit")
+SEMANTIC_CACHE = config.getboolean("RAG", "SemanticCache")
+SLOT_CONTEXT_SIZE = config.getint("RAG", "SlotContextSize")
 
-# Initialize vector embeddings and database
+# Keep-alive connections to the SLM and embeddings endpoints
+http = get_http_session(config_file_name)
+
+# Initialize vector embeddings and the vector store (RDS pgvector or local files)
 vector_embeddings = VectorEmbeddings(config_file_name)
-vector_database = VectorDatabase(config_file_name)
+vector_database = create_vector_store(config_file_name)
+
+# Combines the retrieved chunks into a context measured with the tokenizer of the model
+token_counter = TokenCounter(http, MODEL_ENDPOINTS[SLM1_MODEL_NAME], TIMEOUT)
+context_builder = ContextBuilder(
+    token_counter,
+    token_budget=config.getint("RAG", "ContextTokenBudget"),
+    duplicate_threshold=config.getfloat("RAG", "ContextDuplicateThreshold"),
+)
+
+# Recent turns of each browser session, put in the prompts of follow-ups
+conversations = ConversationStore.from_config(config, PROMPT_TEMPLATE, token_counter)
+
+# Optional cache of complete answers, keyed on the query embedding
+semantic_cache = None
+if SEMANTIC_CACHE:
+    semantic_cache = SemanticCache(
+        max_size=config.getint("RAG", "SemanticCacheSize"),
+        ttl=config.getfloat("RAG", "SemanticCacheTTL"),
+        similarity_threshold=config.getfloat("RAG", "SemanticCacheThreshold"),
+    )
+
+# Optional per-request tracing of the pipeline stages, appended to a local file
+if config.getboolean("RAG", "Tracing"):
+    TRACER.configure(
+        "rag",
+        config.get("RAG", "TraceExportPath"),
+        config.get("RAG", "TraceExportFormat"),
+    )
+
+
+# Every /stream request is traced under the request id sent by the client, or a new one
+@app.before_request
+def start_trace():
+    if request.endpoint == "stream_response":
+        g.trace = TRACER.start_trace(
+            "rag.stream", request.headers.get(REQUEST_ID_HEADER)
+        )
+
+
+# The trace ends once the streamed answer has been sent
+@app.after_request
+def finish_trace(response):
+    trace = g.pop("trace", None)
+    if trace is not None:
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        response.call_on_close(trace.finish)
+    return response
 
 
 # Route for home page
@@ -103,16 +172,27 @@ def stream_response():
     prompt = request.json["message"]
     bot_id = request.json["bot_id"]
     use_rag = request.json["use_rag"]
-    service_url = MODEL_ENDPOINTS[SLM1_MODEL_NAME]
+    endpoints = MODEL_ENDPOINTS[SLM1_MODEL_NAME]
+    # The answers with and without RAG are separate conversations of the session
+    session_id = valid_session_id(request.headers.get(SESSION_ID_HEADER))
+    if session_id and use_rag:
+        session_id += "-rag"
+    history = conversations.history(session_id)
 
     rag_text = ""
+    similar_texts = []
+    context_texts = []
+    query_embedding = None
 
-    # If RAG is enabled, get similar texts from vector database
-    if use_rag:
-        # Get vector embeddings for the query
+    # The query embedding is needed for retrieval and for the semantic cache
+    if use_rag or semantic_cache is not None:
         query_embeddings = vector_embeddings.get_vector_embeddings(prompt)
-        query_embedding = np.array(query_embeddings)
+        # An error message is returned instead of the embeddings on failure
+        if not isinstance(query_embeddings, str):
+            query_embedding = np.array(query_embeddings)
 
+    # If RAG is enabled, get similar texts from vector database
+    if use_rag and query_embedding is not None:
         # Search for similar texts
         similar_texts = vector_database.search_similar_texts(
             query_embedding, limit=LIMIT, similarity_threshold=SIMILAR_THRESHOLD
@@ -120,98 +200,113 @@ def stream_response():
 
         # Process similar texts
         for text, distance in similar_texts:
-            rag_text = text
-            message = f"RAG: {rag_text}, Distance: {distance}"
+            message = f"RAG: {text}, Distance: {distance}"
             print(message)
             logger.info(message)
 
+        # Keep the context within what the model slot has left after the question and
+        # the answer
+        with TRACER.span("context_assembly") as span:
+            question_tokens = token_counter.count(PROMPT_TEMPLATE.render(prompt))
+            question_tokens += conversations.tokens(session_id)
+            rag_text, context_texts, context_tokens = context_builder.build(
+                similar_texts,
+                SLOT_CONTEXT_SIZE - TOKENS_TO_PREDICT - question_tokens,
+            )
+            if span is not None:
+                span.set_attribute("chunks", len(context_texts))
+                span.set_attribute("tokens", context_tokens)
+        logger.info(
+            f"RAG context: {len(context_texts)} of {len(similar_texts)} chunks, "
+            f"{context_tokens} tokens"
+        )
+
+    # The conversation keeps the question with its context, as the prompt had it, so the
+    # prompt of a follow-up question starts with the one the slot has in its KV cache
+    user_turn = PROMPT_TEMPLATE.user_turn(prompt, rag_text)
+
+    # Replay a cached answer to a near-identical question over the same context
+    cache_key = None
+    if semantic_cache is not None and query_embedding is not None:
+        # Follow-up questions only match answers given after the same conversation
+        cache_key = SemanticCache.context_key(
+            SLM1_MODEL_NAME,
+            context_texts + [text for turn in history for text in turn],
+        )
+        with TRACER.span("semantic_cache_lookup") as span:
+            cached_lines = semantic_cache.lookup(query_embedding, cache_key)
+            if span is not None:
+                span.set_attribute("hit", cached_lines is not None)
+        if cached_lines is not None:
+            return app.response_class(
+                conversations.record(session_id, user_turn, iter(cached_lines)),
+                mimetype="application/json",
+                headers={"X-Semantic-Cache": "hit"},
+            )
+
     # Prepare payload for the language model
-    payload = {
-        "prompt": INITIAL_PROMPT + " " + rag_text + " " + prompt,
-        "n_predict": TOKENS_TO_PREDICT,
-        "stream": STREAM_OUTPUT,
-    }
+    with TRACER.span("prompt_assembly"):
+        payload = PROMPT_TEMPLATE.payload(
+            prompt, TOKENS_TO_PREDICT, STREAM_OUTPUT, context=rag_text, history=history
+        )
 
     headers = {"Content-Type": "application/json"}
 
-    # Function to process the streaming response
-    def process_stream(queue):
-        buffer = ""
-
-        try:
-            # Make POST request to the service
-            response = requests.post(
-                service_url, json=payload, headers=headers, stream=True, timeout=TIMEOUT
-            )
-            response.raise_for_status()
-
-            with response:
-                response.raise_for_status()
-
-                # Process response stream chunk by chunk
-                for chunk in response.iter_content(chunk_size=1):
-                    if chunk:
-                        chunk_str = chunk.decode("utf-8", errors="ignore")
-                        buffer += chunk_str
-
-                        # Process complete JSON objects
-                        if buffer.endswith("\n"):
-                            try:
-                                data = json.loads(buffer.strip())
-                                queue.put(json.dumps(data) + "\n")
-                                if data.get("stop", False):
-                                    break
-                            except json.JSONDecodeError as jdc:
-                                error_message = f"E: {str(jdc)} {buffer}"
-                                print(error_message)
-                                logger.error(error_message)
-                                queue.put(buffer)
-                            buffer = ""
-
-                # Process any remaining data
-                if buffer:
-                    queue.put(buffer)
-
-        # Handle various exceptions
-        except requests.exceptions.HTTPError as http_err:
-            logger.error(f"HTTP error occurred: {http_err}")
-            queue.put(json.dumps({"error": f"HTTP error occurred: {http_err}"}) + "\n")
-        except requests.exceptions.ConnectionError as conn_err:
-            logger.error(f"Connection error occurred: {conn_err}")
-            queue.put(
-                json.dumps({"error": f"Connection error occurred: {conn_err}"}) + "\n"
-            )
-        except requests.exceptions.Timeout as timeout_err:
-            logger.error(f"Timeout error occurred: {timeout_err}")
-            queue.put(
-                json.dumps({"error": f"Timeout error occurred: {timeout_err}"}) + "\n"
-            )
-        except requests.exceptions.RequestException as req_err:
-            logger.error(f"Request error occurred: {req_err}")
-            queue.put(
-                json.dumps({"error": f"Request error occurred: {req_err}"}) + "\n"
-            )
-        except Exception as e:
-            logger.error(str(e))
-            queue.put(json.dumps({"error": str(e)}) + "\n")
-        finally:
-            queue.put(None)
+    # Wait for a generation slot of the model, or tell the client when to retry
+    try:
+        with TRACER.span("admission"):
+            admission = ADMISSION_CONTROLLERS[SLM1_MODEL_NAME].admit()
+    except AdmissionRejected as rejected:
+        logger.warning(rejected.message)
+        return app.response_class(
+            error_line(rejected.message),
+            status=rejected.status,
+            mimetype="application/json",
+            headers={"Retry-After": str(rejected.retry_after)},
+        )
 
     # Generator function to yield streaming response
     def generate_stream():
-        queue = Queue()
-        thread = threading.Thread(target=process_stream, args=(queue,))
-        thread.start()
-
-        while True:
-            data = queue.get()
-            if data is None:  # Check for the end signal
-                break
-            yield data
-
-        thread.join()  # Wait for the thread to complete
-
-    return app.response_class(generate_stream(), mimetype="application/json")
+        # Lines of the answer, kept only when it can go into the semantic cache
+        lines = [] if cache_key is not None else None
+        completed = False
+
+        for line in conversations.record(
+            session_id,
+            user_turn,
+            stream_completion(
+                http,
+                endpoints,
+                payload,
+                headers,
+                TIMEOUT,
+                logger,
+                session_id=session_id,
+            ),
+        ):
+            if lines is not None:
+                lines.append(line)
+                completed = completed or is_stop_line(line)
+            yield line
+
+        # Only answers that finished without errors are cached
+        if lines is not None and completed:
+            semantic_cache.store(query_embedding, cache_key, lines)
+
+    response = app.response_class(
+        generate_stream(),
+        mimetype="application/json",
+        headers={"X-Queue-Time-Ms": str(admission.queue_time_ms)},
+    )
+    # The slot is held until the whole answer has been sent or the client has gone away
+    response.call_on_close(admission.release)
+    return response
+
+
+# Route exposing latency histograms in the Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 
 # Start the server if running as main
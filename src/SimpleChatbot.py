@@ -9,16 +9,20 @@ gevent.monkey.patch_all()
 
 # Import necessary modules
 from flask import Flask, request, render_template
-import requests
-import json
-import threading
-from queue import Queue
 from gevent.pywsgi import WSGIServer
 import configparser
 import sys
 import logging
 import os
 from flask_wtf.csrf import CSRFProtect
+from common.StreamRelay import stream_completion, error_line
+from common.HttpSession import get_http_session
+from common.EndpointBalancer import EndpointBalancer, SESSION_ID_HEADER
+from common.PromptTemplate import PromptTemplate
+from common.ContextBuilder import TokenCounter
+from common.ConversationSessions import ConversationStore, valid_session_id
+from common.AdmissionControl import AdmissionController, AdmissionRejected
+from common.Metrics import REGISTRY, CONTENT_TYPE
 
 
 # Initialize Flask application
@@ -67,17 +71,39 @@ SLM2_MODEL_NAME = config.get("DEFAULT", "SLM2_model_name")
 
 # SLM parameters and endpoints for different models
 MODEL_ENDPOINTS = {
-    SLM1_MODEL_NAME: config.get("DEFAULT", "SLM1_endpoint"),
-    SLM2_MODEL_NAME: config.get("DEFAULT", "SLM2_endpoint"),
+    SLM1_MODEL_NAME: EndpointBalancer.from_config(
+        config, "SLM1_endpoint", SLM1_MODEL_NAME
+    ),
+    SLM2_MODEL_NAME: EndpointBalancer.from_config(
+        config, "SLM2_endpoint", SLM2_MODEL_NAME
+    ),
+}
+
+# Concurrency limits and wait queues of the models, scaled with their replicas
+ADMISSION_CONTROLLERS = {
+    model: AdmissionController.from_config(config, len(endpoints.endpoints), name=model)
+    for model, endpoints in MODEL_ENDPOINTS.items()
 }
 
 # Get other configuration parameters
-INITIAL_PROMPT = config.get("DEFAULT", "Initial_prompt")
+# Prompts start with the same system prompt so the servers reuse its cached prefix
+PROMPT_TEMPLATE = PromptTemplate.from_config(config)
 PORT = config.getint("SimpleChatbot", "Port")
 TOKENS_TO_PREDICT = config.getint("SimpleChatbot", "TokensToPredict")
 STREAM_OUTPUT = config.getboolean("SimpleChatbot", "StreamOutput")
 TIMEOUT = config.getint("SimpleChatbot", "Timeout")
 
+# Keep-alive connections to the SLM endpoints
+http = get_http_session("config.ini")
+
+# Recent turns of each browser session, per model, put in the prompts of follow-ups
+CONVERSATIONS = {
+    model: ConversationStore.from_config(
+        config, PROMPT_TEMPLATE, TokenCounter(http, endpoints, TIMEOUT)
+    )
+    for model, endpoints in MODEL_ENDPOINTS.items()
+}
+
 
 # Route for the main page
 @app.route("/")
@@ -93,96 +119,58 @@ def generate():
     prompt = request.json["prompt"]
     model = data.get("model", SLM1_MODEL_NAME)
 
-    # Prepare payload for the model
-    payload = {
-        "prompt": "USER:\n" + INITIAL_PROMPT + prompt + "\nASSISTANT:",
-        "n_predict": TOKENS_TO_PREDICT,
-        "stream": STREAM_OUTPUT,
-    }
+    # Prepare payload for the model, after the earlier turns of the conversation
+    session_id = valid_session_id(request.headers.get(SESSION_ID_HEADER))
+    conversations = CONVERSATIONS[model]
+    payload = PROMPT_TEMPLATE.payload(
+        prompt,
+        TOKENS_TO_PREDICT,
+        STREAM_OUTPUT,
+        history=conversations.history(session_id),
+    )
 
     headers = {"Content-Type": "application/json"}
 
-    # Function to process the stream of data from the model
-    def process_stream(queue):
-        buffer = ""
-        try:
-            # Make request to model endpoint
-            response = requests.post(
+    # Wait for a generation slot of the model, or tell the client when to retry
+    try:
+        admission = ADMISSION_CONTROLLERS[model].admit()
+    except AdmissionRejected as rejected:
+        logger.warning(rejected.message)
+        return app.response_class(
+            error_line(rejected.message),
+            status=rejected.status,
+            mimetype="application/json",
+            headers={"Retry-After": str(rejected.retry_after)},
+        )
+
+    # Stream the model's answer straight through to the client
+    response = app.response_class(
+        conversations.record(
+            session_id,
+            prompt,
+            stream_completion(
+                http,
                 MODEL_ENDPOINTS[model],
-                json=payload,
-                headers=headers,
+                payload,
+                headers,
+                TIMEOUT,
+                logger,
                 stream=STREAM_OUTPUT,
-                timeout=TIMEOUT,
-            )
-            response.raise_for_status()
-
-            # Process streaming response
-            with response:
-                response.raise_for_status()
-                for chunk in response.iter_content(chunk_size=1):
-                    if chunk:
-                        chunk_str = chunk.decode("utf-8", errors="ignore")
-                        buffer += chunk_str
-
-                        # Process complete JSON objects
-                        if buffer.endswith("\n"):
-                            try:
-                                data_json = json.loads(buffer.strip())
-                                queue.put(json.dumps(data_json) + "\n")
-                                if data_json.get("stop", False):
-                                    break
-                            except json.JSONDecodeError as jdc:
-                                error_message = f"E: {str(jdc)} {buffer}"
-                                print(error_message)
-                                logger.error(error_message)
-                                queue.put(buffer)
-
-                            buffer = ""
-
-                # Process any remaining data
-                if buffer:
-                    queue.put(buffer)
-
-        # Handle various exceptions
-        except requests.exceptions.HTTPError as http_err:
-            logger.error(f"HTTP error occurred: {http_err}")
-            queue.put(json.dumps({"error": f"HTTP error occurred: {http_err}"}) + "\n")
-        except requests.exceptions.ConnectionError as conn_err:
-            logger.error(f"Connection error occurred: {conn_err}")
-            queue.put(
-                json.dumps({"error": f"Connection error occurred: {conn_err}"}) + "\n"
-            )
-        except requests.exceptions.Timeout as timeout_err:
-            logger.error(f"Timeout error occurred: {timeout_err}")
-            queue.put(
-                json.dumps({"error": f"Timeout error occurred: {timeout_err}"}) + "\n"
-            )
-        except requests.exceptions.RequestException as req_err:
-            logger.error(f"Request error occurred: {req_err}")
-            queue.put(
-                json.dumps({"error": f"Request error occurred: {req_err}"}) + "\n"
-            )
-        except Exception as e:
-            logger.error(str(e))
-            queue.put(json.dumps({"error": str(e)}) + "\n")
-        finally:
-            queue.put(None)
-
-    # Generator function to yield streaming responses
-    def generate_stream():
-        queue = Queue()
-        thread = threading.Thread(target=process_stream, args=(queue,))
-        thread.start()
-
-        while True:
-            data_result = queue.get()
-            if data_result is None:
-                break
-            yield data_result
-
-        thread.join()
-
-    return app.response_class(generate_stream(), mimetype="application/json")
+                session_id=session_id,
+            ),
+        ),
+        mimetype="application/json",
+        headers={"X-Queue-Time-Ms": str(admission.queue_time_ms)},
+    )
+    # The slot is held until the whole answer has been sent or the client has gone away
+    response.call_on_close(admission.release)
+    return response
+
+
+# Route exposing latency histograms in the Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 
 # Start the server
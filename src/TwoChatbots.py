@@ -8,16 +8,20 @@ gevent.monkey.patch_all()
 
 # Import necessary libraries and modules
 from flask import Flask, render_template, request
-import requests
-import json
-import threading
-from queue import Queue
 from gevent.pywsgi import WSGIServer
 import configparser
 import sys
 import logging
 import os
 from flask_wtf.csrf import CSRFProtect
+from common.StreamRelay import stream_completion, error_line, tag_stream, multiplex
+from common.HttpSession import get_http_session
+from common.EndpointBalancer import EndpointBalancer, SESSION_ID_HEADER
+from common.PromptTemplate import PromptTemplate
+from common.ContextBuilder import TokenCounter
+from common.ConversationSessions import ConversationStore, valid_session_id
+from common.AdmissionControl import AdmissionController, AdmissionRejected
+from common.Metrics import REGISTRY, CONTENT_TYPE
 
 
 # Initialize Flask application
@@ -67,8 +71,18 @@ SLM2_MODEL_NAME = config.get("DEFAULT", "SLM2_model_name")
 
 # Configure model endpoints
 MODEL_ENDPOINTS = {
-    SLM1_MODEL_NAME: config.get("DEFAULT", "SLM1_endpoint"),
-    SLM2_MODEL_NAME: config.get("DEFAULT", "SLM2_endpoint"),
+    SLM1_MODEL_NAME: EndpointBalancer.from_config(
+        config, "SLM1_endpoint", SLM1_MODEL_NAME
+    ),
+    SLM2_MODEL_NAME: EndpointBalancer.from_config(
+        config, "SLM2_endpoint", SLM2_MODEL_NAME
+    ),
+}
+
+# Concurrency limits and wait queues of the models, scaled with their replicas
+ADMISSION_CONTROLLERS = {
+    model: AdmissionController.from_config(config, len(endpoints.endpoints), name=model)
+    for model, endpoints in MODEL_ENDPOINTS.items()
 }
 
 # Get application configuration parameters
@@ -76,7 +90,19 @@ PORT = config.getint("TwoChatbots", "Port")
 TOKENS_TO_PREDICT = config.getint("TwoChatbots", "TokensToPredict")
 STREAM_OUTPUT = config.getboolean("TwoChatbots", "StreamOutput")
 TIMEOUT = config.getint("TwoChatbots", "Timeout")
-INITIAL_PROMPT = config.get("DEFAULT", "Initial_prompt")
+# Prompts start with the same system prompt so the servers reuse its cached prefix
+PROMPT_TEMPLATE = PromptTemplate.from_config(config)
+
+# Keep-alive connections to the SLM endpoints
+http = get_http_session("config.ini")
+
+# Recent turns of each browser session, per model, put in the prompts of follow-ups
+CONVERSATIONS = {
+    model: ConversationStore.from_config(
+        config, PROMPT_TEMPLATE, TokenCounter(http, endpoints, TIMEOUT)
+    )
+    for model, endpoints in MODEL_ENDPOINTS.items()
+}
 
 
 # Route Handlers
@@ -92,98 +118,126 @@ def stream_response():
     # Get request parameters
     prompt = request.json["message"]
     bot_id = request.json["bot_id"]
-    # Select appropriate model endpoint based on bot_id
-    service_url = (
-        MODEL_ENDPOINTS[SLM1_MODEL_NAME]
-        if bot_id == 1
-        else MODEL_ENDPOINTS[SLM2_MODEL_NAME]
+    # Select the model based on bot_id
+    model = SLM1_MODEL_NAME if bot_id == 1 else SLM2_MODEL_NAME
+    endpoints = MODEL_ENDPOINTS[model]
+
+    # Prepare request payload, after the earlier turns of the conversation
+    session_id = valid_session_id(request.headers.get(SESSION_ID_HEADER))
+    conversations = CONVERSATIONS[model]
+    payload = PROMPT_TEMPLATE.payload(
+        prompt,
+        TOKENS_TO_PREDICT,
+        STREAM_OUTPUT,
+        history=conversations.history(session_id),
     )
 
-    # Prepare request payload
-    payload = {
-        "prompt": "USER:\n" + INITIAL_PROMPT + prompt + "\nASSISTANT:",
-        "n_predict": TOKENS_TO_PREDICT,
-        "stream": STREAM_OUTPUT,
-    }
-
     headers = {"Content-Type": "application/json"}
 
-    # Function to process streaming response
-    def process_stream(queue):
-        buffer = ""
+    # Wait for a generation slot of the model, or tell the client when to retry
+    try:
+        admission = ADMISSION_CONTROLLERS[model].admit()
+    except AdmissionRejected as rejected:
+        logger.warning(rejected.message)
+        return app.response_class(
+            error_line(rejected.message),
+            status=rejected.status,
+            mimetype="application/json",
+            headers={"Retry-After": str(rejected.retry_after)},
+        )
+
+    # Stream the model's answer straight through to the client
+    response = app.response_class(
+        conversations.record(
+            session_id,
+            prompt,
+            stream_completion(
+                http,
+                endpoints,
+                payload,
+                headers,
+                TIMEOUT,
+                logger,
+                session_id=session_id,
+            ),
+        ),
+        mimetype="application/json",
+        headers={"X-Queue-Time-Ms": str(admission.queue_time_ms)},
+    )
+    # The slot is held until the whole answer has been sent or the client has gone away
+    response.call_on_close(admission.release)
+    return response
+
+
+# Fan-out route streaming the answers of both models in a single response
+@app.route("/stream_both", methods=["POST"])
+def stream_both():
+    prompt = request.json["message"]
+    # Each model continues its own side of the conversation of the session
+    session_id = valid_session_id(request.headers.get(SESSION_ID_HEADER))
+
+    headers = {"Content-Type": "application/json"}
 
+    # Both models are queried, so a generation slot of each is needed
+    models = {1: SLM1_MODEL_NAME, 2: SLM2_MODEL_NAME}
+    admissions = []
+    for model in models.values():
         try:
-            # Make HTTP request to model endpoint
-            response = requests.post(
-                service_url, json=payload, headers=headers, stream=True, timeout=TIMEOUT
-            )
-            response.raise_for_status()
-
-            with response:
-                # Process response stream chunk by chunk
-                for chunk in response.iter_content(chunk_size=1):
-                    if chunk:
-                        chunk_str = chunk.decode("utf-8", errors="ignore")
-                        buffer += chunk_str
-
-                        # Process complete messages (ending with newline)
-                        if buffer.endswith("\n"):
-                            try:
-                                data = json.loads(buffer.strip())
-                                queue.put(json.dumps(data) + "\n")
-                                if data.get("stop", False):
-                                    break
-                            except json.JSONDecodeError as jdc:
-                                error_message = f"E: {str(jdc)} {buffer}"
-                                print(error_message)
-                                logger.error(error_message)
-                                queue.put(buffer)
-
-                            buffer = ""
-
-                # Process any remaining data in buffer
-                if buffer:
-                    queue.put(buffer)
-
-        # Exception handling for various HTTP and connection errors
-        except requests.exceptions.HTTPError as http_err:
-            logger.error(f"HTTP error occurred: {http_err}")
-            queue.put(json.dumps({"error": f"HTTP error occurred: {http_err}"}) + "\n")
-        except requests.exceptions.ConnectionError as conn_err:
-            logger.error(f"Connection error occurred: {conn_err}")
-            queue.put(
-                json.dumps({"error": f"Connection error occurred: {conn_err}"}) + "\n"
-            )
-        except requests.exceptions.Timeout as timeout_err:
-            logger.error(f"Timeout error occurred: {timeout_err}")
-            queue.put(
-                json.dumps({"error": f"Timeout error occurred: {timeout_err}"}) + "\n"
+            admissions.append(ADMISSION_CONTROLLERS[model].admit())
+        except AdmissionRejected as rejected:
+            for admission in admissions:
+                admission.release()
+            logger.warning(rejected.message)
+            return app.response_class(
+                error_line(rejected.message),
+                status=rejected.status,
+                mimetype="application/json",
+                headers={"Retry-After": str(rejected.retry_after)},
             )
-        except requests.exceptions.RequestException as req_err:
-            logger.error(f"Request error occurred: {req_err}")
-            queue.put(
-                json.dumps({"error": f"Request error occurred: {req_err}"}) + "\n"
-            )
-        except Exception as e:
-            logger.error(str(e))
-            queue.put(json.dumps({"error": str(e)}) + "\n")
-        finally:
-            queue.put(None)  # Signal end of stream
-
-    # Generator function for streaming response
-    def generate_stream():
-        queue = Queue()
-        thread = threading.Thread(target=process_stream, args=(queue,))
-        thread.start()
-        while True:
-            data = queue.get()
-            if data is None:  # Check for end signal
-                break
-            yield data
-
-        thread.join()  # Wait for processing thread to complete
-
-    return app.response_class(generate_stream(), mimetype="application/json")
+
+    # Both answers are generated at the same time and their lines interleaved as they
+    # arrive, each tagged with its bot_id and followed by the metrics of the model
+    streams = [
+        tag_stream(
+            bot_id,
+            model,
+            CONVERSATIONS[model].record(
+                session_id,
+                prompt,
+                stream_completion(
+                    http,
+                    MODEL_ENDPOINTS[model],
+                    PROMPT_TEMPLATE.payload(
+                        prompt,
+                        TOKENS_TO_PREDICT,
+                        STREAM_OUTPUT,
+                        history=CONVERSATIONS[model].history(session_id),
+                    ),
+                    headers,
+                    TIMEOUT,
+                    logger,
+                    session_id=session_id,
+                ),
+            ),
+        )
+        for bot_id, model in models.items()
+    ]
+    queue_time_ms = sum(admission.queue_time_ms for admission in admissions)
+
+    response = app.response_class(
+        multiplex(streams),
+        mimetype="application/x-ndjson",
+        headers={"X-Queue-Time-Ms": str(queue_time_ms)},
+    )
+    for admission in admissions:
+        response.call_on_close(admission.release)
+    return response
+
+
+# Route exposing latency histograms in the Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 
 # Main entry point
@@ -0,0 +1,183 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from gevent.lock import BoundedSemaphore
+from common.Metrics import REGISTRY
+import logging
+import math
+import time
+
+QUEUE_WAIT = REGISTRY.histogram(
+    "slm_queue_wait_seconds",
+    "Seconds a request waited for a generation slot, including rejected requests",
+    ["model"],
+)
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "slm_admission_rejections",
+    "Requests rejected by admission control",
+    ["model", "status"],
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be queued or waited too long for a generation slot."""
+
+    def __init__(self, status, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.message = message
+
+
+class Admission:
+    """A generation slot held by a request; released once its response is closed."""
+
+    def __init__(self, controller, queue_time):
+        self.controller = controller
+        self.queue_time = queue_time
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    @property
+    def queue_time_ms(self):
+        return int(self.queue_time * 1000)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self)
+
+
+class AdmissionController:
+    """
+    Caps the number of concurrent generations forwarded to one model. Requests above the
+    cap wait in a bounded FIFO queue; when the queue is full, or a request has waited
+    longer than the queue timeout, it is rejected at once with a Retry-After estimate
+    instead of piling more work onto an already saturated model server.
+    """
+
+    def __init__(
+        self,
+        max_concurrent=2,
+        max_queue=8,
+        queue_timeout=30,
+        service_time=10.0,
+        name="",
+    ):
+        """
+        Initialize the admission controller.
+
+        Args:
+            max_concurrent (int): Generations forwarded to the model at the same time
+            max_queue (int): Requests allowed to wait for a slot
+            queue_timeout (float): Seconds a request waits for a slot before it is rejected
+            service_time (float): Initial estimate of the seconds a generation takes
+            name (str): Name of the model, used in metrics
+        """
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.slots = BoundedSemaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+
+        # Exponentially weighted moving average of the generation time, for Retry-After
+        self.service_time = service_time
+        self.service_time_alpha = 0.2
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_queue_time = 0.0
+
+    @classmethod
+    def from_config(cls, config, replicas=1, name=""):
+        """
+        Creates a controller from the DEFAULT section; the concurrency limit is given per
+        replica so it grows with the replicas of the model
+        """
+        return cls(
+            max_concurrent=config.getint("DEFAULT", "MaxConcurrentPerReplica")
+            * replicas,
+            max_queue=config.getint("DEFAULT", "MaxQueuedRequests"),
+            queue_timeout=config.getfloat("DEFAULT", "QueueTimeout"),
+            name=name,
+        )
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_queue_time_ms": (
+                self.total_queue_time / self.admitted * 1000 if self.admitted else 0.0
+            ),
+            "avg_service_time_ms": self.service_time * 1000,
+        }
+
+    def retry_after(self):
+        """
+        Seconds until a slot is expected to be free for a request arriving now: every
+        queued request plus this one needs a generation, served max_concurrent at a time
+        """
+        batches = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(batches * self.service_time))
+
+    def admit(self):
+        """
+        Waits for a generation slot and returns the Admission holding it.
+
+        Raises:
+            AdmissionRejected: 429 when the wait queue is full, 503 when no slot became
+                free within the queue timeout
+        """
+        queued_at = time.monotonic()
+
+        # Requests only queue when every slot is taken
+        if not self.slots.acquire(blocking=False):
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                ADMISSION_REJECTIONS.inc(model=self.name, status=429)
+                raise AdmissionRejected(
+                    429,
+                    self.retry_after(),
+                    "The model is busy, too many requests are waiting",
+                )
+
+            self.waiting += 1
+            try:
+                acquired = self.slots.acquire(timeout=self.queue_timeout)
+            finally:
+                self.waiting -= 1
+
+            if not acquired:
+                self.rejected_timeout += 1
+                QUEUE_WAIT.observe(time.monotonic() - queued_at, model=self.name)
+                ADMISSION_REJECTIONS.inc(model=self.name, status=503)
+                self.logger.warning(
+                    f"Request rejected after waiting {self.queue_timeout} seconds for a generation slot"
+                )
+                raise AdmissionRejected(
+                    503,
+                    self.retry_after(),
+                    "The model is busy, no generation slot became available in time",
+                )
+
+        queue_time = time.monotonic() - queued_at
+        QUEUE_WAIT.observe(queue_time, model=self.name)
+        self.active += 1
+        self.admitted += 1
+        self.total_queue_time += queue_time
+        return Admission(self, queue_time)
+
+    def release(self, admission):
+        elapsed = time.monotonic() - admission.admitted_at
+        self.service_time += self.service_time_alpha * (elapsed - self.service_time)
+        self.active -= 1
+        self.slots.release()
@@ -0,0 +1,206 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+import psycopg2
+from psycopg2 import extensions
+from common.Tracing import TRACER
+from gevent.socket import wait_read, wait_write
+from gevent.lock import BoundedSemaphore
+from contextlib import contextmanager
+from collections import deque
+import gevent
+import logging
+import time
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """
+    psycopg2 wait callback that yields to the gevent hub instead of blocking the process
+    while a query or connection handshake is in flight
+    """
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+class ConnectionPool:
+    """A gevent-aware pool of reusable psycopg2 connections."""
+
+    def __init__(
+        self,
+        connect,
+        min_size=1,
+        max_size=10,
+        acquire_timeout=10,
+        idle_timeout=300,
+        health_check_interval=30,
+    ):
+        """
+        Initialize the connection pool.
+
+        Args:
+            connect (callable): Function returning a new psycopg2 connection
+            min_size (int): Number of idle connections kept open by the evictor
+            max_size (int): Maximum number of connections open at the same time
+            acquire_timeout (float): Seconds to wait for a free connection
+            idle_timeout (float): Seconds after which surplus idle connections are closed
+            health_check_interval (float): Idle seconds after which a connection is pinged before reuse
+        """
+        self.logger = logging.getLogger(__name__)
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+
+        # Idle connections as (connection, last_used) pairs, most recently used last
+        self.idle = deque()
+        self.slots = BoundedSemaphore(max_size)
+
+        extensions.set_wait_callback(gevent_wait_callback)
+
+        self.evictor = gevent.spawn(self._evict_forever)
+
+    @property
+    def in_use(self):
+        return self.max_size - self.slots.counter
+
+    @property
+    def size(self):
+        return self.in_use + len(self.idle)
+
+    def stats(self):
+        return {"size": self.size, "idle": len(self.idle), "in_use": self.in_use}
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection for the duration of the with block. Uncommitted work is rolled
+        back when the connection is returned; broken connections are discarded, and so are
+        connections of a greenlet that was killed or timed out, which may still have a
+        query in flight.
+        """
+        with TRACER.span("connection_acquire"):
+            conn = self.acquire()
+        try:
+            yield conn
+        except BaseException as e:
+            self.release(
+                conn, discard=not isinstance(e, Exception) or self._is_broken(conn)
+            )
+            raise
+        else:
+            self.release(conn)
+
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            raise PoolTimeout(
+                f"No database connection available after {self.acquire_timeout} seconds"
+            )
+
+        try:
+            while self.idle:
+                conn, last_used = self.idle.pop()
+                if self._is_healthy(conn, last_used):
+                    return conn
+                self._close(conn)
+
+            return self.connect()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        try:
+            if not discard and not conn.closed:
+                try:
+                    if (
+                        conn.get_transaction_status()
+                        != extensions.TRANSACTION_STATUS_IDLE
+                    ):
+                        conn.rollback()
+                    self.idle.append((conn, time.monotonic()))
+                    return
+                except psycopg2.Error as e:
+                    self.logger.warning(f"Discarding connection on release: {e}")
+
+            self._close(conn)
+        finally:
+            self.slots.release()
+
+    def close_all(self):
+        while self.idle:
+            conn, _ = self.idle.pop()
+            self._close(conn)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        # The connection has been idle long enough that the server or a NAT may have dropped it
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            self.logger.warning(f"Health check failed, discarding connection: {e}")
+            return False
+
+    @staticmethod
+    def _is_broken(conn):
+        # psycopg2 sets closed to 2 when the connection was lost during an operation
+        return conn.closed != 0
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error as e:
+            self.logger.warning(f"Error closing connection: {e}")
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        kept = deque()
+
+        # Oldest connections are at the left of the deque
+        while self.idle:
+            conn, last_used = self.idle.popleft()
+            surplus = len(kept) + len(self.idle) >= self.min_size
+            if surplus and now - last_used > self.idle_timeout:
+                self._close(conn)
+            else:
+                kept.append((conn, last_used))
+
+        self.idle.extend(kept)
+
+    def _fill_to_min_size(self):
+        while self.size < self.min_size and self.slots.acquire(blocking=False):
+            try:
+                conn = self.connect()
+            except Exception as e:
+                self.slots.release()
+                self.logger.warning(f"Could not open pooled connection: {e}")
+                return
+            self.release(conn)
+
+    def _evict_forever(self):
+        interval = max(1, min(self.idle_timeout, self.health_check_interval))
+        while True:
+            self._fill_to_min_size()
+            gevent.sleep(interval)
+            self._evict_idle()
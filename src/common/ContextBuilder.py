@@ -0,0 +1,238 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from collections import OrderedDict
+from common.Metrics import REGISTRY, COUNT_BUCKETS
+import requests
+import logging
+import gevent
+import re
+
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "rag_context_tokens",
+    "Tokens of knowledge base context put into a prompt",
+    buckets=COUNT_BUCKETS,
+)
+CONTEXT_CHUNKS = REGISTRY.histogram(
+    "rag_context_chunks",
+    "Retrieved chunks put into a prompt after duplicates were dropped and the budget applied",
+    buckets=COUNT_BUCKETS,
+)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class TokenCounter:
+    """
+    Counts tokens with the tokenizer of the model, through the /tokenize endpoint of its
+    llama.cpp server. Counts are cached per text, since the same knowledge base chunks are
+    retrieved again and again. When the server cannot be reached the count is estimated
+    from the length of the text.
+    """
+
+    # Rough characters per token of English text, used when the server cannot tokenize
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, http, endpoints, timeout=5, cache_size=4096):
+        """
+        Initialize the token counter.
+
+        Args:
+            http (HttpSession): Shared session the requests are sent with
+            endpoints (EndpointBalancer): Replicas of the model whose tokenizer is used
+            timeout (float): Read timeout in seconds
+            cache_size (int): Maximum number of cached counts
+        """
+        self.logger = logging.getLogger(__name__)
+        self.http = http
+        self.endpoints = endpoints
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    @staticmethod
+    def tokenize_url(url):
+        """
+        The /tokenize endpoint of the server of a /completion endpoint
+        """
+        return url.rsplit("/", 1)[0] + "/tokenize"
+
+    def estimate(self, text):
+        return -(-len(text) // self.CHARS_PER_TOKEN)
+
+    def count(self, text):
+        """
+        Returns the number of tokens of a text
+        """
+        if text in self.cache:
+            self.cache.move_to_end(text)
+            return self.cache[text]
+
+        lease = self.endpoints.acquire()
+        try:
+            response = self.http.post(
+                self.tokenize_url(lease.url), self.timeout, json={"content": text}
+            )
+            response.raise_for_status()
+            tokens = len(response.json()["tokens"])
+        except (ValueError, KeyError) as e:
+            # Also catches the JSON decoding errors of requests, which are no failure of
+            # the replica
+            self.logger.warning(f"Tokenization failed, estimating the count: {e}")
+            return self.estimate(text)
+        except requests.exceptions.RequestException as e:
+            # Server and network errors count against the replica, so a dead one is
+            # ejected instead of being asked again for every count
+            if e.response is None or e.response.status_code >= 500:
+                lease.fail()
+            self.logger.warning(f"Tokenization failed, estimating the count: {e}")
+            return self.estimate(text)
+        finally:
+            lease.release()
+
+        self.cache[text] = tokens
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return tokens
+
+    def count_many(self, texts):
+        """
+        Returns the number of tokens of each text; texts that are not cached are
+        tokenized concurrently
+        """
+        jobs = {
+            text: gevent.spawn(self.count, text)
+            for text in set(texts)
+            if text not in self.cache
+        }
+        gevent.joinall(list(jobs.values()))
+        return [
+            jobs[text].value if text in jobs else self.count(text) for text in texts
+        ]
+
+
+def shingles(text, size=3):
+    """
+    The set of word n-grams of a text, used to compare chunks regardless of whitespace,
+    case and punctuation
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextBuilder:
+    """
+    Builds the knowledge base context of a RAG prompt from the retrieved chunks: chunks
+    are kept in relevance order, near-duplicates of a more relevant chunk are dropped, and
+    chunks are added until the token budget is spent. The last chunk that does not fit
+    whole is cut at a word boundary when enough of the budget is left for it to be useful.
+    A smaller prompt means less prefill work on the model server before the first token.
+    """
+
+    def __init__(
+        self,
+        token_counter,
+        token_budget=384,
+        duplicate_threshold=0.8,
+        min_chunk_tokens=32,
+        separator="\n\n",
+    ):
+        """
+        Initialize the context builder.
+
+        Args:
+            token_counter (TokenCounter): Counts tokens with the tokenizer of the model
+            token_budget (int): Maximum tokens of context
+            duplicate_threshold (float): Word trigram Jaccard similarity from which a
+                chunk is a near-duplicate of a more relevant one
+            min_chunk_tokens (int): Smallest part of a chunk worth adding when the chunk
+                does not fit whole
+            separator (str): Text put between chunks
+        """
+        self.token_counter = token_counter
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.min_chunk_tokens = min_chunk_tokens
+        self.separator = separator
+
+    def deduplicate(self, texts):
+        """
+        Drops the texts that are near-duplicates of an earlier text
+        """
+        kept = []
+        kept_shingles = []
+        for text in texts:
+            text_shingles = shingles(text)
+            if any(
+                jaccard(text_shingles, other) >= self.duplicate_threshold
+                for other in kept_shingles
+            ):
+                continue
+            kept.append(text)
+            kept_shingles.append(text_shingles)
+        return kept
+
+    @staticmethod
+    def truncate(text, tokens, max_tokens):
+        """
+        Cuts a text to about max_tokens at a word boundary, assuming its tokens are spread
+        evenly over its characters
+        """
+        end = len(text) * max_tokens // tokens
+        cut = text.rfind(" ", 0, end)
+        return text[: cut if cut > 0 else end].rstrip()
+
+    def build(self, similar_texts, token_budget=None):
+        """
+        Builds the context from the (text, similarity) pairs of a search, most similar
+        first.
+
+        Args:
+            similar_texts (List[Tuple[str, float]]): Retrieved chunks
+            token_budget (int): Budget of this prompt, at most the configured budget
+
+        Returns:
+            Tuple[str, List[str], int]: The context, the chunks it was built from and its
+                estimated number of tokens
+        """
+        budget = self.token_budget
+        if token_budget is not None:
+            budget = min(budget, token_budget)
+
+        texts = self.deduplicate(
+            [text.strip() for text, _ in similar_texts if text.strip()]
+        )
+        if not texts or budget <= 0:
+            CONTEXT_TOKENS.observe(0)
+            CONTEXT_CHUNKS.observe(0)
+            return "", [], 0
+
+        # Counted with the model tokenizer like the chunks, and cached after the first time
+        separator_tokens = self.token_counter.count(self.separator)
+        used = []
+        total = 0
+        for text, tokens in zip(texts, self.token_counter.count_many(texts)):
+            cost = tokens + (separator_tokens if used else 0)
+            if total + cost <= budget:
+                used.append(text)
+                total += cost
+                continue
+
+            # Use what is left of the budget for part of the chunk, then stop
+            remaining = budget - total - (separator_tokens if used else 0)
+            if remaining >= self.min_chunk_tokens:
+                used.append(self.truncate(text, tokens, remaining))
+                total += budget - total
+            break
+
+        CONTEXT_TOKENS.observe(total)
+        CONTEXT_CHUNKS.observe(len(used))
+        return self.separator.join(used), used, total
@@ -0,0 +1,153 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from collections import OrderedDict
+from common.StreamRelay import is_stop_line, line_content
+import re
+import time
+
+# Session ids are generated by the browsers; anything else is served without history
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{8,64}")
+
+
+def valid_session_id(value):
+    """
+    Returns the session id of a request header, or None when it is missing or malformed
+    """
+    if value and SESSION_ID_PATTERN.fullmatch(value):
+        return value
+    return None
+
+
+class Conversation:
+    """The past turns of a session with their tokens, oldest first."""
+
+    def __init__(self):
+        # (question, answer, tokens) of every kept turn
+        self.turns = []
+        self.tokens = 0
+        self.last_used = time.time()
+
+
+class ConversationStore:
+    """
+    Keeps the recent turns of each session of one model in memory, so a follow-up
+    question is answered with the conversation in its prompt without the client sending
+    it again.
+
+    History is append-only while it fits the token budget: the prompt of every turn then
+    starts with the prompt and answer of the previous one, which the slot the session is
+    pinned to still holds in its KV cache, and only the new question is prefilled. When
+    the budget is exceeded the oldest turns are dropped down to half of it at once, so the
+    cached prefix is lost once per trim rather than on every turn.
+    """
+
+    def __init__(
+        self, template, token_counter, history_tokens=384, max_sessions=1000, ttl=1800
+    ):
+        """
+        Initialize the conversation store.
+
+        Args:
+            template (PromptTemplate): Template the turns are rendered with
+            token_counter (TokenCounter): Counts tokens with the tokenizer of the model
+            history_tokens (int): Maximum tokens of history per session, 0 disables
+                history
+            max_sessions (int): Sessions kept, least recently used evicted first
+            ttl (float): Seconds of inactivity after which a session expires
+        """
+        self.template = template
+        self.token_counter = token_counter
+        self.history_tokens = history_tokens
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+
+        # Session id -> Conversation, least recently used first
+        self.sessions = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config, template, token_counter):
+        """
+        Creates a store from the Conversation options of the DEFAULT section
+        """
+        return cls(
+            template,
+            token_counter,
+            history_tokens=config.getint("DEFAULT", "ConversationHistoryTokens"),
+            max_sessions=config.getint("DEFAULT", "ConversationSessions"),
+            ttl=config.getfloat("DEFAULT", "ConversationTTL"),
+        )
+
+    @property
+    def enabled(self):
+        return self.history_tokens > 0
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "turns": sum(len(c.turns) for c in self.sessions.values()),
+        }
+
+    def evict_expired(self):
+        now = time.time()
+        while self.sessions:
+            session_id, conversation = next(iter(self.sessions.items()))
+            if now - conversation.last_used < self.ttl:
+                break
+            del self.sessions[session_id]
+
+    def history(self, session_id):
+        """
+        Returns the (question, answer) pairs kept for a session, oldest first
+        """
+        self.evict_expired()
+
+        conversation = self.sessions.get(session_id) if session_id else None
+        if conversation is None:
+            return []
+        return [(question, answer) for question, answer, _ in conversation.turns]
+
+    def tokens(self, session_id):
+        """
+        Returns the tokens of the history kept for a session
+        """
+        conversation = self.sessions.get(session_id) if session_id else None
+        return conversation.tokens if conversation is not None else 0
+
+    def append(self, session_id, question, answer):
+        """
+        Adds a completed turn to a session, trimming its history to the token budget
+        """
+        tokens = self.token_counter.count(self.template.render_turn(question, answer))
+
+        conversation = self.sessions.pop(session_id, None) or Conversation()
+        conversation.turns.append((question, answer, tokens))
+        conversation.tokens += tokens
+        conversation.last_used = time.time()
+
+        if conversation.tokens > self.history_tokens:
+            while conversation.turns and conversation.tokens > self.history_tokens // 2:
+                conversation.tokens -= conversation.turns.pop(0)[2]
+
+        self.sessions[session_id] = conversation
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def record(self, session_id, question, lines):
+        """
+        Relays the lines of a streamed answer and, once the generation has completed
+        without errors, adds the question and the generated text to the session
+        """
+        if not self.enabled or not session_id:
+            yield from lines
+            return
+
+        answer = []
+        completed = False
+        for line in lines:
+            answer.append(line_content(line))
+            completed = completed or is_stop_line(line)
+            yield line
+
+        if completed:
+            self.append(session_id, question, "".join(answer))
@@ -0,0 +1,173 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from collections import OrderedDict
+import numpy as np
+import hashlib
+import logging
+import sqlite3
+import time
+
+
+class EmbeddingCache:
+    """
+    Bounded in-process LRU cache of embeddings keyed on normalized text, with TTL eviction
+    and an optional SQLite tier shared by every process on the host.
+    """
+
+    # Number of writes between two clean-ups of the shared tier
+    SHARED_PRUNE_INTERVAL = 100
+
+    def __init__(self, max_size=1024, ttl=3600, shared_path=None, shared_max_size=0):
+        """
+        Initialize the embedding cache.
+
+        Args:
+            max_size (int): Maximum number of embeddings kept in memory
+            ttl (float): Seconds after which a cached embedding expires
+            shared_path (str): SQLite file of the shared tier (disabled when empty)
+            shared_max_size (int): Maximum number of embeddings kept in the shared tier
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_max_size = shared_max_size
+
+        # Normalized text -> (embedding, stored_at), least recently used first
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.shared = None
+        if shared_path:
+            self.shared = sqlite3.connect(
+                shared_path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            self.shared.execute("PRAGMA journal_mode=WAL;")
+            self.shared.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL,
+                    stored_at REAL NOT NULL
+                );
+            """
+            )
+            self.shared.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_stored_at_idx ON embeddings (stored_at);"
+            )
+        self.shared_writes = 0
+
+    @staticmethod
+    def normalize(text):
+        """
+        Collapses whitespace and case; all-MiniLM-L6-v2 is uncased, so the embedding
+        does not change
+        """
+        return " ".join(text.split()).lower()
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+        }
+
+    def get(self, text):
+        key = self.normalize(text)
+        now = time.time()
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            embedding, stored_at = entry
+            if now - stored_at < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+            del self.entries[key]
+
+        embedding = self.get_shared(key, now)
+        if embedding is not None:
+            self.shared_hits += 1
+            self.put_local(key, embedding, now)
+            return embedding
+
+        self.misses += 1
+        return None
+
+    def put(self, text, embedding):
+        key = self.normalize(text)
+        now = time.time()
+
+        # Callers share the cached array, so it must not be modified in place
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.flags.writeable = False
+
+        self.put_local(key, embedding, now)
+        self.put_shared(key, embedding, now)
+
+    def put_local(self, key, embedding, stored_at):
+        self.entries[key] = (embedding, stored_at)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def shared_key(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_shared(self, key, now):
+        if self.shared is None:
+            return None
+
+        try:
+            row = self.shared.execute(
+                "SELECT embedding, stored_at FROM embeddings WHERE key = ?;",
+                (self.shared_key(key),),
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Shared embedding cache read failed: {e}")
+            return None
+
+        if row is None or now - row[1] >= self.ttl:
+            return None
+
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put_shared(self, key, embedding, stored_at):
+        if self.shared is None:
+            return
+
+        try:
+            self.shared.execute(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, stored_at) VALUES (?, ?, ?);",
+                (self.shared_key(key), embedding.tobytes(), stored_at),
+            )
+            self.shared_writes += 1
+            if self.shared_writes % self.SHARED_PRUNE_INTERVAL:
+                return
+
+            # Periodically drop expired entries and keep the shared tier within its size limit
+            self.shared.execute(
+                "DELETE FROM embeddings WHERE stored_at < ?;", (stored_at - self.ttl,)
+            )
+            if self.shared_max_size:
+                self.shared.execute(
+                    """
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+                    );
+                """,
+                    (self.shared_max_size,),
+                )
+        except sqlite3.Error as e:
+            self.logger.warning(f"Shared embedding cache write failed: {e}")
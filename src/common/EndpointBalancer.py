@@ -0,0 +1,225 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+import itertools
+import hashlib
+import logging
+import time
+
+# Header carrying the id of the client session whose requests are pinned to one replica
+SESSION_ID_HEADER = "X-Session-Id"
+
+
+def affinity_hash(*parts):
+    """
+    Hash of a session id that is stable across processes and restarts, unlike hash()
+    """
+    digest = hashlib.blake2b("\0".join(parts).encode("utf-8"), digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+
+class Endpoint:
+    """One replica of a model server and its load and health statistics."""
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        # Exponentially weighted moving average of the time to first response line
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def is_ejected(self, now):
+        return now < self.ejected_until
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "ewma_latency_ms": (
+                self.ewma_latency * 1000 if self.ewma_latency is not None else None
+            ),
+            "consecutive_failures": self.consecutive_failures,
+            "ejected": self.is_ejected(time.monotonic()),
+        }
+
+
+def round_robin(balancer, endpoints):
+    return endpoints[next(balancer.counter) % len(endpoints)]
+
+
+def least_outstanding(balancer, endpoints):
+    # Ties are broken in round robin order so idle replicas share the load
+    offset = next(balancer.counter)
+    rotated = (
+        endpoints[offset % len(endpoints) :] + endpoints[: offset % len(endpoints)]
+    )
+    return min(rotated, key=lambda endpoint: endpoint.outstanding)
+
+
+def ewma(balancer, endpoints):
+    # Replicas without a latency sample yet are tried first, then the expected wait
+    # (latency times the requests queued on the replica) decides
+    unmeasured = [e for e in endpoints if e.ewma_latency is None]
+    if unmeasured:
+        return least_outstanding(balancer, unmeasured)
+    return min(
+        endpoints,
+        key=lambda endpoint: endpoint.ewma_latency * (endpoint.outstanding + 1),
+    )
+
+
+# Balancing strategies by configuration name
+STRATEGIES = {
+    "round_robin": round_robin,
+    "least_outstanding": least_outstanding,
+    "ewma": ewma,
+}
+
+
+class Lease:
+    """A request in flight on an endpoint, reported back to the balancer when done."""
+
+    def __init__(self, balancer, endpoint, slot=None):
+        self.balancer = balancer
+        self.endpoint = endpoint
+        self.url = endpoint.url
+        # llama.cpp slot the request is pinned to, or None to let the server choose
+        self.slot = slot
+        self.started_at = time.monotonic()
+        self.first_response_at = None
+        self.failed = False
+        self.released = False
+
+    def first_response(self):
+        """
+        Records the latency to the first response line; later calls are ignored
+        """
+        if self.first_response_at is None:
+            self.first_response_at = time.monotonic()
+            self.balancer.record_latency(
+                self.endpoint, self.first_response_at - self.started_at
+            )
+
+    def fail(self):
+        self.failed = True
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.balancer.release(self)
+
+
+class EndpointBalancer:
+    """
+    Spreads the requests for one model over its replicas with a pluggable strategy, and
+    passively ejects replicas after consecutive failures for a cool-down period.
+
+    Requests carrying a session id bypass the strategy and are pinned by rendezvous
+    hashing to one healthy replica, and optionally to one of its llama.cpp slots, so the
+    prompt prefix already in that slot's KV cache is reused instead of prefilled again.
+    """
+
+    def __init__(
+        self,
+        urls,
+        strategy="round_robin",
+        eject_after_failures=3,
+        ejection_seconds=30,
+        ewma_alpha=0.3,
+        slots_per_replica=0,
+        name="",
+    ):
+        """
+        Initialize the endpoint balancer.
+
+        Args:
+            urls (List[str]): Endpoints of the replicas of the model
+            strategy (str): round_robin, least_outstanding or ewma
+            eject_after_failures (int): Consecutive failures after which a replica is ejected
+            ejection_seconds (float): Seconds an ejected replica receives no requests
+            ewma_alpha (float): Weight of the newest latency sample in the moving average
+            slots_per_replica (int): Parallel slots of each llama.cpp server that sessions
+                are pinned to; 0 lets the server choose the slot
+            name (str): Name of the model, used in logs and metrics
+        """
+        if not urls:
+            raise ValueError("At least one endpoint is required")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy: {strategy}")
+
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.strategy = STRATEGIES[strategy]
+        self.eject_after_failures = eject_after_failures
+        self.ejection_seconds = ejection_seconds
+        self.ewma_alpha = ewma_alpha
+        self.slots_per_replica = slots_per_replica
+        self.counter = itertools.count()
+
+    @classmethod
+    def from_config(cls, config, option, name=""):
+        """
+        Creates a balancer from a comma-separated list of endpoints in the DEFAULT section
+        """
+        urls = [url.strip() for url in config.get("DEFAULT", option).split(",")]
+        return cls(
+            [url for url in urls if url],
+            strategy=config.get("DEFAULT", "LoadBalancingStrategy"),
+            eject_after_failures=config.getint("DEFAULT", "EjectAfterFailures"),
+            ejection_seconds=config.getfloat("DEFAULT", "EjectionSeconds"),
+            slots_per_replica=config.getint("DEFAULT", "SlotsPerReplica"),
+            name=name,
+        )
+
+    def stats(self):
+        return [endpoint.to_dict() for endpoint in self.endpoints]
+
+    def acquire(self, session_id=None):
+        """
+        Picks a replica for a new request, the replica of its session when a session id
+        is given. When every replica is ejected, all of them are tried again rather than
+        failing the request outright.
+        """
+        now = time.monotonic()
+        healthy = [e for e in self.endpoints if not e.is_ejected(now)] or self.endpoints
+
+        if not session_id:
+            endpoint = self.strategy(self, healthy)
+            endpoint.outstanding += 1
+            return Lease(self, endpoint)
+
+        # Rendezvous hashing: a session only moves when its replica is ejected, and then
+        # only the sessions of that replica move
+        endpoint = max(
+            healthy, key=lambda endpoint: affinity_hash(session_id, endpoint.url)
+        )
+        slot = None
+        if self.slots_per_replica > 0:
+            slot = affinity_hash(session_id) % self.slots_per_replica
+
+        endpoint.outstanding += 1
+        return Lease(self, endpoint, slot)
+
+    def record_latency(self, endpoint, latency):
+        if endpoint.ewma_latency is None:
+            endpoint.ewma_latency = latency
+        else:
+            endpoint.ewma_latency += self.ewma_alpha * (latency - endpoint.ewma_latency)
+
+    def release(self, lease):
+        endpoint = lease.endpoint
+        endpoint.outstanding -= 1
+
+        if not lease.failed:
+            endpoint.consecutive_failures = 0
+            return
+
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.eject_after_failures:
+            endpoint.ejected_until = time.monotonic() + self.ejection_seconds
+            self.logger.warning(
+                f"Ejecting {endpoint.url} for {self.ejection_seconds} seconds after "
+                f"{endpoint.consecutive_failures} consecutive failures"
+            )
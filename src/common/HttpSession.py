@@ -0,0 +1,56 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+import requests
+from requests.adapters import HTTPAdapter
+import configparser
+
+# Shared sessions, one per configuration file
+_sessions = {}
+
+
+class HttpSession:
+    """
+    Keep-alive HTTP session shared by the SLM and embeddings clients of a process, with a
+    connection pool per host and separate connect and read timeouts.
+    """
+
+    def __init__(self, configfile_name):
+        # ----------------------------------------------------------------------------------------------------------------------
+        # Load the configuration file
+        #
+        config = configparser.ConfigParser()
+        config.read(configfile_name)
+
+        self.POOL_CONNECTIONS = config.getint("HTTP", "PoolConnections")
+        self.POOL_MAX_SIZE = config.getint("HTTP", "PoolMaxSize")
+        self.CONNECT_TIMEOUT = config.getfloat("HTTP", "ConnectTimeout")
+
+        # pool_connections is the number of hosts with a pool, pool_maxsize the number of
+        # connections kept alive per host
+        adapter = HTTPAdapter(
+            pool_connections=self.POOL_CONNECTIONS,
+            pool_maxsize=self.POOL_MAX_SIZE,
+            max_retries=0,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def timeout(self, read_timeout):
+        return (self.CONNECT_TIMEOUT, read_timeout)
+
+    def post(self, url, read_timeout, **kwargs):
+        """
+        Sends a POST request on a pooled connection
+        """
+        return self.session.post(url, timeout=self.timeout(read_timeout), **kwargs)
+
+
+def get_http_session(configfile_name):
+    """
+    Returns the process-wide session for a configuration file, creating it on first use
+    """
+    if configfile_name not in _sessions:
+        _sessions[configfile_name] = HttpSession(configfile_name)
+    return _sessions[configfile_name]
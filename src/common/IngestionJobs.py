@@ -0,0 +1,98 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from gevent.lock import BoundedSemaphore
+from collections import OrderedDict
+import gevent
+import logging
+import time
+import uuid
+
+
+class IngestionJob:
+    """State and progress of one background document ingestion."""
+
+    def __init__(self, filename):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"
+        self.message = None
+        self.pipeline = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self):
+        job = {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.pipeline is not None:
+            job["progress"] = self.pipeline.stats()
+        return job
+
+
+class IngestionJobManager:
+    """
+    Runs ingestion jobs in background greenlets, at most max_concurrent at a time, and keeps
+    the most recent jobs so their progress can be queried.
+    """
+
+    def __init__(self, max_concurrent=2, history_size=100):
+        """
+        Initialize the job manager.
+
+        Args:
+            max_concurrent (int): Maximum number of ingestions running at the same time
+            history_size (int): Number of jobs kept for status queries
+        """
+        self.logger = logging.getLogger(__name__)
+        self.slots = BoundedSemaphore(max_concurrent)
+        self.history_size = history_size
+        self.jobs = OrderedDict()
+
+    def submit(self, filename, target, *args):
+        """
+        Queues a job and returns it right away. The target is called as target(job, *args)
+        once a slot is free and may set job.pipeline to report progress.
+        """
+        job = IngestionJob(filename)
+        self.jobs[job.job_id] = job
+        self._trim_history()
+
+        gevent.spawn(self._run, job, target, *args)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _run(self, job, target, *args):
+        with self.slots:
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.message = target(job, *args)
+                job.status = "succeeded"
+            except Exception as e:
+                self.logger.error(f"Ingestion job {job.job_id} failed: {e}")
+                job.message = f"An error occurred: {str(e)}"
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+
+    def _trim_history(self):
+        # Forget the oldest finished jobs; running and queued jobs are always kept
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.history_size:
+                break
+            if self.jobs[job_id].done:
+                del self.jobs[job_id]
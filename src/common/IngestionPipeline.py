@@ -0,0 +1,203 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from gevent.queue import Queue
+import gevent
+import hashlib
+import logging
+import time
+
+# Marks the end of the items flowing through a stage queue
+END_OF_STREAM = object()
+
+
+class IngestionPipeline:
+    """
+    Ingests a document as concurrent stages connected by bounded queues:
+    page extraction -> chunking -> batched embedding -> batched database writes.
+    A full queue blocks the stage feeding it, so memory stays bounded and the
+    overall time is set by the slowest stage rather than the sum of all stages.
+    """
+
+    def __init__(
+        self,
+        vector_embeddings,
+        vector_database,
+        embedding_batch_size=32,
+        insert_batch_size=500,
+        queue_size=64,
+        source=None,
+        existing_chunk_hashes=None,
+    ):
+        """
+        Initialize the ingestion pipeline.
+
+        Args:
+            vector_embeddings (VectorEmbeddings): Client of the embeddings service
+            vector_database (VectorStore): Store the chunks are written to
+            embedding_batch_size (int): Chunks sent per embeddings request
+            insert_batch_size (int): Rows written per database transaction
+            queue_size (int): Capacity of the queue between two stages
+            source (str): Name of the document the chunks are tagged with
+            existing_chunk_hashes (Set[str]): Hashes of chunks already stored for the
+                document, which are neither embedded nor written again
+        """
+        self.logger = logging.getLogger(__name__)
+        self.vector_embeddings = vector_embeddings
+        self.vector_database = vector_database
+        self.embedding_batch_size = embedding_batch_size
+        self.insert_batch_size = insert_batch_size
+        self.queue_size = queue_size
+        self.source = source
+        self.existing_chunk_hashes = existing_chunk_hashes or set()
+
+        # Content hashes of every chunk of the document, stored or not
+        self.chunk_hashes = set()
+
+        # Progress counters
+        self.pages_parsed = 0
+        self.chunks_created = 0
+        self.chunks_skipped = 0
+        self.chunks_embedded = 0
+        self.rows_written = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def stats(self):
+        end = self.finished_at or time.monotonic()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "pages_parsed": self.pages_parsed,
+            "chunks_created": self.chunks_created,
+            "chunks_skipped": self.chunks_skipped,
+            "chunks_embedded": self.chunks_embedded,
+            "rows_written": self.rows_written,
+            "elapsed_seconds": elapsed,
+            "chunks_per_second": self.rows_written / elapsed if elapsed else 0.0,
+        }
+
+    @staticmethod
+    def drain(queue):
+        """
+        Iterates over the items of a stage queue until the end-of-stream marker
+        """
+        while True:
+            item = queue.get()
+            if item is END_OF_STREAM:
+                return
+            yield item
+
+    @staticmethod
+    def batches(items, batch_size):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def extract_stage(self, pages, page_queue):
+        for page in pages:
+            self.pages_parsed += 1
+            page_queue.put(page)
+            # Page parsing is CPU bound; let the other stages run between pages
+            gevent.sleep(0)
+        page_queue.put(END_OF_STREAM)
+
+    @staticmethod
+    def hash_chunk(chunk):
+        return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+    def chunk_stage(self, chunker, page_queue, chunk_queue):
+        for chunk in chunker(self.drain(page_queue)):
+            self.chunks_created += 1
+
+            # Chunks stored by a previous version of the document, or repeated within
+            # this one, are not embedded again
+            chunk_hash = self.hash_chunk(chunk.text)
+            seen = chunk_hash in self.chunk_hashes
+            self.chunk_hashes.add(chunk_hash)
+            if seen or chunk_hash in self.existing_chunk_hashes:
+                self.chunks_skipped += 1
+                continue
+
+            chunk_queue.put((chunk, chunk_hash))
+        chunk_queue.put(END_OF_STREAM)
+
+    def embed_stage(self, chunk_queue, embedded_queue):
+        for batch in self.batches(self.drain(chunk_queue), self.embedding_batch_size):
+            texts = [chunk.text for chunk, _ in batch]
+            embeddings = self.vector_embeddings.get_vector_embeddings_batch(texts)
+            self.chunks_embedded += len(batch)
+            embedded_queue.put((batch, embeddings))
+        embedded_queue.put(END_OF_STREAM)
+
+    def write_stage(self, embedded_queue):
+        texts = []
+        chunk_hashes = []
+        locations = []
+        embeddings = []
+
+        def flush():
+            inserted_ids = self.vector_database.insert_many(
+                texts,
+                embeddings,
+                page_size=self.insert_batch_size,
+                source=self.source,
+                chunk_hashes=chunk_hashes,
+                locations=locations,
+            )
+            self.rows_written += len(inserted_ids)
+            texts.clear()
+            chunk_hashes.clear()
+            locations.clear()
+            embeddings.clear()
+
+        for batch, batch_embeddings in self.drain(embedded_queue):
+            for chunk, chunk_hash in batch:
+                texts.append(chunk.text)
+                chunk_hashes.append(chunk_hash)
+                locations.append(chunk.location())
+            embeddings.extend(batch_embeddings)
+            if len(texts) >= self.insert_batch_size:
+                flush()
+
+        if texts:
+            flush()
+
+    def run(self, pages, chunker):
+        """
+        Runs all the stages concurrently and waits for them to finish.
+
+        Args:
+            pages (Iterable): Pages of the document, produced lazily
+            chunker (callable): Turns an iterable of pages into an iterable of Chunk
+
+        Returns:
+            Dict[str, Any]: Final progress counters
+        """
+        page_queue = Queue(self.queue_size)
+        chunk_queue = Queue(self.queue_size)
+        embedded_queue = Queue(self.queue_size)
+
+        self.started_at = time.monotonic()
+        stages = [
+            gevent.spawn(self.extract_stage, pages, page_queue),
+            gevent.spawn(self.chunk_stage, chunker, page_queue, chunk_queue),
+            gevent.spawn(self.embed_stage, chunk_queue, embedded_queue),
+            gevent.spawn(self.write_stage, embedded_queue),
+        ]
+
+        try:
+            gevent.joinall(stages, raise_error=True)
+        except Exception:
+            # A failed stage would leave its neighbours blocked on the queues
+            gevent.killall(stages)
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+
+        self.logger.info(f"Ingestion finished: {self.stats()}")
+        return self.stats()
@@ -0,0 +1,519 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from common.VectorStore import (
+    VectorStore,
+    VECTOR_SEARCH_LATENCY,
+    VECTOR_INSERT_LATENCY,
+)
+from common.Tracing import TRACER
+import numpy as np
+import configparser
+import threading
+import logging
+import json
+import os
+
+
+def normalize_rows(embeddings):
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store on the local disk of the instance, for knowledge bases served from a
+    single edge node without a round trip to RDS.
+
+    Embeddings are L2-normalized and appended to a float32 matrix file that is memory-mapped
+    for search. Texts and metadata are appended to a JSON lines file, and a row exists once
+    its line has been written. Up to IVFMinRows rows are searched exhaustively; above that
+    an inverted file (IVF) index groups the rows by their nearest k-means centroid and a
+    search only scans the IVFProbes groups closest to the query.
+
+    One process (KnowledgeBase) writes the store. Other processes (RAG) pick up the rows
+    it appended before each search, so a store is shared without a server.
+    """
+
+    BACKEND = "local"
+
+    MATRIX_FILE = "embeddings.f32"
+    METADATA_FILE = "chunks.jsonl"
+    CENTROIDS_FILE = "centroids.npy"
+
+    # Rows sampled to train the centroids and k-means iterations
+    TRAINING_SAMPLE_SIZE = 65536
+    TRAINING_ITERATIONS = 10
+
+    def __init__(self, configfile_name):
+        self.logger = logging.getLogger(__name__)
+        # ----------------------------------------------------------------------------------------------------------------------
+        # Load the configuration file
+        #
+        config = configparser.ConfigParser()
+        config.read(configfile_name)
+
+        self.PATH = config.get("VectorStore", "LocalPath")
+        self.DIMENSION = config.getint("VectorStore", "Dimension")
+        self.IVF_MIN_ROWS = config.getint("VectorStore", "IVFMinRows")
+        self.IVF_PROBES = config.getint("VectorStore", "IVFProbes")
+
+        os.makedirs(self.PATH, exist_ok=True)
+        self.matrix_path = os.path.join(self.PATH, self.MATRIX_FILE)
+        self.metadata_path = os.path.join(self.PATH, self.METADATA_FILE)
+        self.centroids_path = os.path.join(self.PATH, self.CENTROIDS_FILE)
+
+        self.lock = threading.RLock()
+        self.load()
+
+    def create_vector_table(self):
+        # The files are created on the first insert
+        pass
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Loading and refreshing
+    #
+    def load(self):
+        """
+        Reads the whole store and rebuilds the in-memory state
+        """
+        with self.lock:
+            # Row of the matrix -> metadata of the rows that exist
+            self.rows = {}
+            self.alive = np.zeros(0, dtype=bool)
+            self.matrix = None
+            self.metadata_offset = 0
+            self.metadata_inode = None
+
+            self.centroids = None
+            self.lists = None
+            self.trained_rows = 0
+
+            if os.path.exists(self.metadata_path):
+                self.metadata_inode = os.stat(self.metadata_path).st_ino
+                self.read_metadata()
+
+            if os.path.exists(self.centroids_path) and self.rows:
+                centroids = np.load(self.centroids_path)
+                if centroids.ndim == 2 and centroids.shape[1] == self.DIMENSION:
+                    self.centroids = centroids.astype(np.float32)
+                    self.trained_rows = len(self.rows)
+                    self.build_lists()
+
+            self.maybe_train()
+
+    def refresh(self):
+        """
+        Picks up the rows appended by the writing process since the last read; a rewritten
+        metadata file (new inode) is loaded again from scratch
+        """
+        try:
+            stat = os.stat(self.metadata_path)
+        except FileNotFoundError:
+            return
+
+        with self.lock:
+            if stat.st_ino != self.metadata_inode:
+                self.load()
+            elif stat.st_size > self.metadata_offset:
+                self.read_metadata()
+                self.maybe_train()
+
+    def read_metadata(self):
+        with open(self.metadata_path, "rb") as f:
+            f.seek(self.metadata_offset)
+            data = f.read()
+
+        # A line that is still being written is read on the next refresh
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return
+        self.metadata_offset += end
+
+        records = [json.loads(line) for line in data[:end].splitlines() if line]
+        self.map_matrix()
+        self.add_rows(records)
+
+    def map_matrix(self):
+        row_bytes = self.DIMENSION * 4
+        rows = (
+            os.path.getsize(self.matrix_path) // row_bytes
+            if os.path.exists(self.matrix_path)
+            else 0
+        )
+        if self.matrix is not None and len(self.matrix) == rows:
+            return
+
+        self.matrix = (
+            np.memmap(
+                self.matrix_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(rows, self.DIMENSION),
+            )
+            if rows
+            else None
+        )
+        if len(self.alive) < rows:
+            self.alive = np.concatenate(
+                [self.alive, np.zeros(rows - len(self.alive), dtype=bool)]
+            )
+
+    def add_rows(self, records):
+        for record in records:
+            self.rows[record["row"]] = record
+            self.alive[record["row"]] = True
+
+        if self.lists is not None and records:
+            self.assign_rows(np.array([record["row"] for record in records]))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # IVF index
+    #
+    def maybe_train(self):
+        """
+        Trains the centroids once the store is large enough for the index to pay off, and
+        again whenever it has doubled in size since the last training
+        """
+        live = len(self.rows)
+        if live < self.IVF_MIN_ROWS:
+            return
+        if self.centroids is not None and live < 2 * self.trained_rows:
+            return
+        self.train()
+
+    def train(self):
+        live_rows = np.flatnonzero(self.alive)
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(
+            rng.choice(
+                live_rows,
+                size=min(len(live_rows), self.TRAINING_SAMPLE_SIZE),
+                replace=False,
+            )
+        )
+        sample = np.asarray(self.matrix[sample_rows])
+
+        # Spherical k-means: the rows are normalized, so the nearest centroid is the one
+        # with the largest dot product
+        list_count = min(int(np.clip(np.sqrt(len(live_rows)), 16, 4096)), len(sample))
+        centroids = sample[rng.choice(len(sample), size=list_count, replace=False)]
+        for _ in range(self.TRAINING_ITERATIONS):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            # Sum the rows of each list in one pass over the rows sorted by list;
+            # empty lists keep their previous centroid
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=list_count)
+            filled = counts > 0
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[filled] = normalize_rows(sums)
+
+        self.centroids = centroids
+        self.trained_rows = len(live_rows)
+        self.build_lists()
+
+        try:
+            temp_path = self.centroids_path + ".tmp.npy"
+            np.save(temp_path, centroids)
+            os.replace(temp_path, self.centroids_path)
+        except OSError as e:
+            self.logger.warning(f"Could not save the vector store centroids: {e}")
+
+        self.logger.info(
+            f"Trained {list_count} IVF lists over {len(live_rows)} embeddings"
+        )
+
+    def build_lists(self):
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+        self.assign_rows(np.flatnonzero(self.alive))
+
+    def assign_rows(self, rows, block_size=65536):
+        for start in range(0, len(rows), block_size):
+            block = rows[start : start + block_size]
+            assignments = np.argmax(
+                np.asarray(self.matrix[block]) @ self.centroids.T, axis=1
+            )
+            for list_id in np.unique(assignments):
+                self.lists[list_id] = np.concatenate(
+                    [self.lists[list_id], block[assignments == list_id]]
+                )
+
+    def candidate_rows(self, query):
+        """
+        Rows to score for a query: all rows of the IVFProbes closest lists, or None for
+        an exhaustive scan
+        """
+        if self.lists is None:
+            return None
+
+        probes = min(self.IVF_PROBES, len(self.centroids))
+        closest = np.argpartition(self.centroids @ query, -probes)[-probes:]
+        rows = np.concatenate([self.lists[list_id] for list_id in closest])
+        return rows[self.alive[rows]]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Writes
+    #
+    def write_metadata(self, records):
+        data = b"".join(
+            json.dumps(record).encode("utf-8") + b"\n" for record in records
+        )
+        with open(self.metadata_path, "ab") as f:
+            f.write(data)
+
+        inode = os.stat(self.metadata_path).st_ino
+        if self.metadata_inode is None:
+            self.metadata_inode = inode
+        self.metadata_offset += len(data)
+
+    def insert_text_and_embedding(self, text, vector_embeddings):
+        try:
+            return self.insert_many([text], [vector_embeddings])[0]
+        except Exception:
+            # Logged by insert_many
+            return None
+
+    def insert_many(
+        self,
+        texts,
+        vector_embeddings,
+        page_size=500,
+        source=None,
+        chunk_hashes=None,
+        locations=None,
+    ):
+        """
+        Appends the embeddings to the matrix, then their metadata lines, which makes the
+        rows visible to searches. page_size is ignored; every call is a single write.
+        """
+        if len(texts) != len(vector_embeddings):
+            raise ValueError(
+                f"Got {len(texts)} texts but {len(vector_embeddings)} embeddings"
+            )
+
+        if not len(texts):
+            return []
+
+        if chunk_hashes is None:
+            chunk_hashes = [None] * len(texts)
+        if locations is None:
+            locations = [(None, None, None, None)] * len(texts)
+
+        try:
+            embeddings = normalize_rows(vector_embeddings)
+            if embeddings.shape[1] != self.DIMENSION:
+                raise ValueError(
+                    f"Got embeddings of dimension {embeddings.shape[1]}, expected {self.DIMENSION}"
+                )
+
+            with VECTOR_INSERT_LATENCY.time(), self.lock:
+                self.refresh()
+                self.map_matrix()
+                first_row = len(self.matrix) if self.matrix is not None else 0
+
+                with open(self.matrix_path, "ab") as f:
+                    f.write(embeddings.tobytes())
+
+                records = [
+                    {
+                        "row": first_row + i,
+                        "text": text,
+                        "source": source,
+                        "chunk_hash": chunk_hash,
+                        "document_hash": None,
+                        "page_start": page_start,
+                        "page_end": page_end,
+                        "start_offset": start_offset,
+                        "end_offset": end_offset,
+                    }
+                    for i, (
+                        text,
+                        chunk_hash,
+                        (page_start, page_end, start_offset, end_offset),
+                    ) in enumerate(zip(texts, chunk_hashes, locations))
+                ]
+                self.write_metadata(records)
+
+                self.map_matrix()
+                self.add_rows(records)
+                self.maybe_train()
+
+            inserted_ids = [record["row"] for record in records]
+            print(f"Successfully inserted {len(inserted_ids)} rows")
+            return inserted_ids
+
+        except Exception as e:
+            self.logger.error(f"Could not insert {len(texts)} rows: {e}")
+            raise
+
+    def document_exists(self, document_hash):
+        self.refresh()
+        with self.lock:
+            return any(
+                record["document_hash"] == document_hash
+                for record in self.rows.values()
+            )
+
+    def get_chunk_hashes(self, source):
+        self.refresh()
+        with self.lock:
+            return {
+                record["chunk_hash"]
+                for record in self.rows.values()
+                if record["source"] == source and record["chunk_hash"] is not None
+            }
+
+    def finalize_document(self, source, document_hash, chunk_hashes):
+        """
+        Deletes the rows of previous versions of the document and tags the current ones
+        with its content hash. The metadata file is rewritten and atomically replaced;
+        the matrix keeps the embeddings of deleted rows.
+        """
+        chunk_hashes = set(chunk_hashes)
+
+        with self.lock:
+            self.refresh()
+
+            deleted_rows = [
+                row
+                for row, record in self.rows.items()
+                if record["source"] == source
+                and record["chunk_hash"] not in chunk_hashes
+            ]
+            for row in deleted_rows:
+                del self.rows[row]
+                self.alive[row] = False
+            for record in self.rows.values():
+                if record["source"] == source:
+                    record["document_hash"] = document_hash
+
+            temp_path = self.metadata_path + ".tmp"
+            data = b"".join(
+                json.dumps(record).encode("utf-8") + b"\n"
+                for _, record in sorted(self.rows.items())
+            )
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self.metadata_path)
+
+            self.metadata_inode = os.stat(self.metadata_path).st_ino
+            self.metadata_offset = len(data)
+
+        return len(deleted_rows)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Search
+    #
+    def search_similar_texts(self, query_embedding, limit=5, similarity_threshold=0.8):
+        """
+        Searches for similar texts using cosine similarity
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        return self.search(query, limit, similarity_threshold)[0]
+
+    def search_similar_texts_batch(
+        self, query_embeddings, limit=5, similarity_threshold=0.8
+    ):
+        """
+        Searches for the texts similar to each of several queries, scoring all queries
+        against the matrix in a single matrix product when the scan is exhaustive
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if not len(queries):
+            return []
+        return self.search(queries, limit, similarity_threshold)
+
+    def search(self, queries, limit, similarity_threshold):
+        try:
+            with VECTOR_SEARCH_LATENCY.time(), TRACER.span(
+                "vector_search",
+                limit=limit,
+                queries=len(queries),
+                backend=self.BACKEND,
+            ) as span:
+                self.refresh()
+
+                with self.lock:
+                    if self.matrix is None or not self.rows or limit <= 0:
+                        return [[] for _ in queries]
+
+                    queries = normalize_rows(queries)
+                    if self.lists is None:
+                        # Exact search: one (rows x queries) product over the whole
+                        # matrix, deleted rows can never be selected
+                        similarities = np.asarray(self.matrix @ queries.T).T
+                        similarities[:, ~self.alive[: similarities.shape[1]]] = -np.inf
+                        rows = np.arange(similarities.shape[1])
+                        results = [
+                            self.top_texts(
+                                rows, query_similarities, limit, similarity_threshold
+                            )
+                            for query_similarities in similarities
+                        ]
+                        rows_scanned = len(rows)
+                    else:
+                        results = []
+                        rows_scanned = 0
+                        for query in queries:
+                            rows = self.candidate_rows(query)
+                            results.append(
+                                self.top_texts(
+                                    rows,
+                                    np.asarray(self.matrix[rows] @ query),
+                                    limit,
+                                    similarity_threshold,
+                                )
+                            )
+                            rows_scanned += len(rows)
+
+                    if span is not None:
+                        span.set_attribute("rows_scanned", rows_scanned)
+
+                    return results
+
+        except Exception as e:
+            error_message = f"An error occurred: {e}"
+            print(error_message)
+            self.logger.error(error_message)
+
+            return [[] for _ in queries]
+
+    def top_texts(self, rows, similarities, limit, similarity_threshold):
+        """
+        The texts of the limit most similar rows above the threshold, most similar first;
+        argpartition selects them without sorting all the similarities
+        """
+        if len(similarities) > limit:
+            top = np.argpartition(similarities, -limit)[-limit:]
+        else:
+            top = np.arange(len(similarities))
+        top = top[np.argsort(similarities[top])[::-1]]
+
+        return [
+            (self.rows[rows[i]]["text"], float(similarities[i]))
+            for i in top
+            if similarities[i] > similarity_threshold
+        ]
+
+
+class BruteForceVectorStore(LocalVectorStore):
+    """
+    Exact variant of the local store: every search is a single matrix product over all
+    the embeddings, with no index to train or tune. It reads and writes the same files,
+    so it also serves as the recall baseline of the IVF index over the same data.
+    """
+
+    BACKEND = "exact"
+
+    def maybe_train(self):
+        # The matrix is always scanned exhaustively
+        pass
+
+    def build_lists(self):
+        # Centroids trained by the local backend over the same files are ignored, so the
+        # lists stay None and every search is exhaustive
+        self.centroids = None
+        self.lists = None
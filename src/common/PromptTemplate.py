@@ -0,0 +1,92 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+
+
+class PromptTemplate:
+    """
+    Lays out the prompts of the applications so every prompt of a model starts with the
+    same bytes: the turn marker and the system prompt, ended by a newline. The llama.cpp
+    server keeps the evaluated prompt of each slot in its KV cache and, with cache_prompt,
+    only prefills the tokens after the longest common prefix, so the system prompt is
+    evaluated once per slot instead of on every request.
+
+    The static prefix ends with a newline so the first word of the variable part cannot
+    merge with it into a different token, which would break the common prefix.
+    """
+
+    def __init__(
+        self,
+        system_prompt,
+        cache_prompt=True,
+        user_marker="USER:",
+        assistant_marker="ASSISTANT:",
+    ):
+        """
+        Initialize the prompt template.
+
+        Args:
+            system_prompt (str): Static instructions put at the start of every prompt
+            cache_prompt (bool): Whether the server reuses the cached prompt prefix
+            user_marker (str): Marker of the user turn
+            assistant_marker (str): Marker of the assistant turn the model completes
+        """
+        self.system_prompt = system_prompt.strip()
+        self.cache_prompt = cache_prompt
+        self.user_marker = user_marker
+        self.assistant_marker = assistant_marker
+        self.prefix = f"{user_marker}\n{self.system_prompt}\n"
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Creates the template of the Initial_prompt and PromptCache options of the DEFAULT
+        section
+        """
+        return cls(
+            config.get("DEFAULT", "Initial_prompt"),
+            cache_prompt=config.getboolean("DEFAULT", "PromptCache"),
+        )
+
+    def user_turn(self, question, context=""):
+        """
+        Returns the user turn of a question as it is in the prompt, after the knowledge
+        base context when there is one. A conversation keeps this text as the question of
+        the turn, so the prompt of the next question repeats it byte for byte.
+        """
+        if context:
+            return f"Context:\n{context}\nQuestion: {question.strip()}"
+        return question.strip()
+
+    def render_turn(self, question, answer):
+        """
+        Returns a past turn of a conversation exactly as it was in the prompt of its
+        question followed by the generated answer, ready for the next question
+        """
+        return (
+            f"{question.strip()}\n{self.assistant_marker}{answer}\n{self.user_marker}\n"
+        )
+
+    def render(self, question, context="", history=()):
+        """
+        Returns the prompt of a question, after the past turns of its conversation and
+        with the knowledge base context when there is one. The prompt of a follow-up
+        question starts with the prompt and answer of the previous one, which are still
+        in the KV cache of the slot that generated them.
+        """
+        prompt = self.prefix + "".join(
+            self.render_turn(past_question, past_answer)
+            for past_question, past_answer in history
+        )
+        return f"{prompt}{self.user_turn(question, context)}\n{self.assistant_marker}"
+
+    def payload(self, question, n_predict, stream, context="", history=()):
+        """
+        Returns the JSON body of a completion request for a question
+        """
+        return {
+            "prompt": self.render(question, context, history),
+            "n_predict": n_predict,
+            "stream": stream,
+            "cache_prompt": self.cache_prompt,
+        }
@@ -0,0 +1,124 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from collections import OrderedDict
+import numpy as np
+import hashlib
+import time
+
+
+class SemanticCache:
+    """
+    Caches complete streamed answers keyed on the query embedding. A new query whose
+    cosine similarity to a cached one reaches the threshold replays the cached answer.
+
+    Every entry also carries a context key built from the model and the retrieved
+    knowledge base chunks, so an answer is only replayed while retrieval still returns
+    the same context. The key is checked on every lookup, after retrieval: a new, changed
+    or deleted document that changes the retrieved chunks makes the lookup miss, with no
+    signal needed from the ingestion process. Nothing else invalidates entries: an entry
+    whose context is no longer retrieved is never matched again and leaves the cache when
+    it expires or is evicted.
+    """
+
+    def __init__(self, max_size=256, ttl=600, similarity_threshold=0.95):
+        """
+        Initialize the semantic cache.
+
+        Args:
+            max_size (int): Maximum number of cached answers
+            ttl (float): Seconds after which a cached answer expires
+            similarity_threshold (float): Minimum cosine similarity for a hit
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+        # Entry id -> (normalized embedding, context key, lines, stored_at), oldest first
+        self.entries = OrderedDict()
+        self.next_id = 0
+
+        # Stacked embeddings of the entries, rebuilt lazily after changes
+        self.matrix = None
+        self.matrix_ids = []
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def context_key(model, context_texts):
+        """
+        Fingerprint of the model and the retrieved chunks an answer was generated from
+        """
+        digest = hashlib.sha256(model.encode("utf-8"))
+        for text in context_texts:
+            digest.update(b"\0")
+            digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def normalize(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+    def lookup(self, embedding, context_key):
+        """
+        Returns the lines of the most similar cached answer with the same context key,
+        or None
+        """
+        self.evict_expired()
+
+        if not self.entries:
+            self.misses += 1
+            return None
+
+        if self.matrix is None:
+            self.matrix_ids = list(self.entries)
+            self.matrix = np.stack([self.entries[i][0] for i in self.matrix_ids])
+
+        similarities = self.matrix @ self.normalize(embedding)
+
+        # Best candidates first; stop at the first one with a matching context
+        for index in np.argsort(similarities)[::-1]:
+            if similarities[index] < self.similarity_threshold:
+                break
+            entry_id = self.matrix_ids[index]
+            _, entry_context_key, lines, _ = self.entries[entry_id]
+            if entry_context_key == context_key:
+                self.entries.move_to_end(entry_id)
+                self.hits += 1
+                return lines
+
+        self.misses += 1
+        return None
+
+    def store(self, embedding, context_key, lines):
+        self.entries[self.next_id] = (
+            self.normalize(embedding),
+            context_key,
+            list(lines),
+            time.time(),
+        )
+        self.next_id += 1
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+        self.matrix = None
+
+    def evict_expired(self):
+        now = time.time()
+        expired = [
+            entry_id
+            for entry_id, (_, _, _, stored_at) in self.entries.items()
+            if now - stored_at >= self.ttl
+        ]
+        for entry_id in expired:
+            del self.entries[entry_id]
+
+        if expired:
+            self.matrix = None
@@ -0,0 +1,304 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from gevent.queue import Queue
+import requests
+import gevent
+import json
+import time
+from common.Metrics import REGISTRY, COUNT_BUCKETS
+from common.Tracing import TRACER
+
+# Byte patterns of a top-level "stop": true in the compact or spaced JSON of a stream line.
+# Quotes inside string values are escaped, so generated text cannot produce them.
+STOP_PATTERNS = (b'"stop":true', b'"stop": true')
+
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "slm_time_to_first_token_seconds",
+    "Seconds from sending a completion request to receiving its first token",
+    ["model"],
+)
+INTER_TOKEN_LATENCY = REGISTRY.histogram(
+    "slm_inter_token_latency_seconds",
+    "Seconds between two consecutive streamed tokens",
+    ["model"],
+)
+GENERATION_TIME = REGISTRY.histogram(
+    "slm_generation_seconds",
+    "Seconds from sending a completion request to the end of its stream",
+    ["model"],
+)
+TOKENS_GENERATED = REGISTRY.histogram(
+    "slm_tokens_generated",
+    "Tokens streamed per completed generation",
+    ["model"],
+    buckets=COUNT_BUCKETS,
+)
+
+
+def iter_lines(response):
+    """
+    Yields the complete lines (bytes, newline included) of a streamed HTTP response.
+
+    The upstream is read in whatever chunks arrive and split with a bytearray, so there is
+    no per-byte Python work. Lines are split on the newline byte, which never occurs inside
+    a multibyte UTF-8 sequence, so characters split across chunks are forwarded intact.
+    """
+    buffer = bytearray()
+
+    for chunk in response.iter_content(chunk_size=None):
+        if not chunk:
+            continue
+
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            yield bytes(buffer[start : end + 1])
+            start = end + 1
+
+        if start:
+            del buffer[:start]
+
+    # Forward any trailing data without a final newline
+    if buffer:
+        yield bytes(buffer)
+
+
+def is_stop_line(line):
+    """
+    Checks whether an NDJSON or SSE ("data: {...}") line is the final line of a generation.
+    Only lines that contain a stop pattern are parsed as JSON.
+    """
+    if isinstance(line, str):
+        line = line.encode("utf-8")
+
+    if not any(pattern in line for pattern in STOP_PATTERNS):
+        return False
+
+    payload = line.strip()
+    if payload.startswith(b"data:"):
+        payload = payload[len(b"data:") :].strip()
+
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return False
+
+    return isinstance(data, dict) and data.get("stop", False) is True
+
+
+def is_token_line(line):
+    """
+    Checks whether a stream line carries a generated token, that is a content line that
+    is not the final line of the generation
+    """
+    if isinstance(line, str):
+        line = line.encode("utf-8")
+
+    return b'"content"' in line and not is_stop_line(line)
+
+
+def line_content(line):
+    """
+    Returns the generated text carried by an NDJSON or SSE stream line, or an empty
+    string for lines without content
+    """
+    if isinstance(line, str):
+        line = line.encode("utf-8")
+
+    if b'"content"' not in line:
+        return ""
+
+    payload = line.strip()
+    if payload.startswith(b"data:"):
+        payload = payload[len(b"data:") :].strip()
+
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return ""
+
+    content = data.get("content") if isinstance(data, dict) else None
+    return content if isinstance(content, str) else ""
+
+
+def relay_lines(response):
+    """
+    Yields the lines of a streamed completion as they arrive, without re-encoding them,
+    and stops after the final line of the generation.
+    """
+    for line in iter_lines(response):
+        yield line
+        if is_stop_line(line):
+            break
+
+
+def error_line(message):
+    return json.dumps({"error": message}) + "\n"
+
+
+def stream_completion(
+    http, endpoints, payload, headers, timeout, logger, stream=True, session_id=None
+):
+    """
+    Posts a completion request and yields the lines of the streamed answer directly from
+    the upstream response, so the WSGI server writes each line to the client before the
+    next one is read. A slow client therefore slows down the upstream read instead of
+    making the proxy buffer the whole generation. Errors are yielded as JSON lines.
+
+    Args:
+        http (HttpSession): Shared session the request is sent with
+        endpoints (EndpointBalancer): Replicas of the model, one is picked per request
+        payload (Dict[str, Any]): JSON body of the request
+        headers (Dict[str, str]): Request headers
+        timeout (float): Read timeout in seconds
+        logger (logging.Logger): Logger of the calling application
+        stream (bool): Whether to stream the response
+        session_id (str): Client session pinned to one replica and slot, if any
+    """
+    lease = endpoints.acquire(session_id)
+    if lease.slot is not None:
+        payload = dict(payload, id_slot=lease.slot)
+    model = endpoints.name
+    started_at = time.monotonic()
+    last_token_at = None
+    tokens = 0
+    span = TRACER.start_span("generation", model=model, url=lease.url)
+
+    try:
+        # Make POST request to the service on a pooled keep-alive connection
+        response = http.post(
+            lease.url, timeout, json=payload, headers=headers, stream=stream
+        )
+        response.raise_for_status()
+
+        with response:
+            for line in relay_lines(response):
+                lease.first_response()
+                if is_token_line(line):
+                    now = time.monotonic()
+                    if last_token_at is None:
+                        TIME_TO_FIRST_TOKEN.observe(now - started_at, model=model)
+                        if span is not None:
+                            span.set_attribute(
+                                "time_to_first_token_ms", (now - started_at) * 1000
+                            )
+                    else:
+                        INTER_TOKEN_LATENCY.observe(now - last_token_at, model=model)
+                    last_token_at = now
+                    tokens += 1
+                yield line
+
+        GENERATION_TIME.observe(time.monotonic() - started_at, model=model)
+        TOKENS_GENERATED.observe(tokens, model=model)
+
+    # Handle various exceptions; server and network errors count against the replica
+    except requests.exceptions.HTTPError as http_err:
+        if http_err.response is None or http_err.response.status_code >= 500:
+            lease.fail()
+        logger.error(f"HTTP error occurred: {http_err}")
+        yield error_line(f"HTTP error occurred: {http_err}")
+    except requests.exceptions.ConnectionError as conn_err:
+        lease.fail()
+        logger.error(f"Connection error occurred: {conn_err}")
+        yield error_line(f"Connection error occurred: {conn_err}")
+    except requests.exceptions.Timeout as timeout_err:
+        lease.fail()
+        logger.error(f"Timeout error occurred: {timeout_err}")
+        yield error_line(f"Timeout error occurred: {timeout_err}")
+    except requests.exceptions.RequestException as req_err:
+        lease.fail()
+        logger.error(f"Request error occurred: {req_err}")
+        yield error_line(f"Request error occurred: {req_err}")
+    except Exception as e:
+        logger.error(str(e))
+        yield error_line(str(e))
+    finally:
+        lease.release()
+        if span is not None:
+            span.set_attribute("tokens", tokens)
+            span.set_attribute("replica_failed", lease.failed)
+        TRACER.end_span(span)
+
+
+def tag_stream(tag, model, lines):
+    """
+    Wraps every NDJSON or SSE line of a model's stream as {"bot_id": tag, "data": {...}},
+    splicing the original JSON in without decoding it, and ends the stream with a metrics
+    line holding the time to first token and the tokens per second of the model.
+    """
+    prefix = b'{"bot_id":' + json.dumps(tag).encode("utf-8") + b',"data":'
+    started_at = time.monotonic()
+    first_token_at = None
+    tokens = 0
+
+    for line in lines:
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+
+        payload = line.strip()
+        if payload.startswith(b"data:"):
+            payload = payload[len(b"data:") :].strip()
+        # Skip the blank separator lines of SSE
+        if not payload:
+            continue
+
+        if is_token_line(payload):
+            tokens += 1
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+
+        yield prefix + payload + b"}\n"
+
+    finished_at = time.monotonic()
+    generation_time = finished_at - first_token_at if first_token_at else 0.0
+    metrics = {
+        "model": model,
+        "time_to_first_token_ms": (
+            (first_token_at - started_at) * 1000 if first_token_at else None
+        ),
+        "total_ms": (finished_at - started_at) * 1000,
+        "tokens": tokens,
+        "tokens_per_second": (
+            # The first token arrives at first_token_at, the others in generation_time
+            (tokens - 1) / generation_time
+            if tokens > 1 and generation_time > 0
+            else None
+        ),
+    }
+    yield json.dumps({"bot_id": tag, "metrics": metrics}) + "\n"
+
+
+def multiplex(streams, queue_size=64):
+    """
+    Reads several line streams concurrently, each in its own greenlet, and yields their
+    lines in arrival order. The bounded queue applies backpressure to the upstream reads
+    when the client is slow; the readers are killed if the client goes away.
+    """
+    queue = Queue(maxsize=queue_size)
+    end_of_stream = object()
+
+    def read(stream):
+        # A killed reader (GreenletExit) must not block on a queue nobody drains any more
+        try:
+            for line in stream:
+                queue.put(line)
+        except Exception as e:
+            queue.put(error_line(str(e)))
+        queue.put(end_of_stream)
+
+    readers = [gevent.spawn(read, stream) for stream in streams]
+    remaining = len(readers)
+
+    try:
+        while remaining:
+            line = queue.get()
+            if line is end_of_stream:
+                remaining -= 1
+                continue
+            yield line
+    finally:
+        gevent.killall(readers, block=False)
@@ -0,0 +1,197 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+import re
+
+# Paragraphs of a page text are separated by a blank line
+PARAGRAPH_SEPARATOR = "\n\n"
+
+# A sentence runs up to terminal punctuation followed by whitespace, or to the end of
+# its paragraph
+SENTENCE_PATTERN = re.compile(r"\S.*?(?:[.!?](?=\s)|\Z)", re.S)
+WORD_PATTERN = re.compile(r"\S+")
+
+
+class Chunk:
+    """A chunk of a document with the pages and character offsets it spans."""
+
+    def __init__(self, text, start_page, end_page, start_offset, end_offset, tokens):
+        self.text = text
+        self.start_page = start_page
+        self.end_page = end_page
+        # Offsets in the texts of the start and end pages
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.tokens = tokens
+
+    def location(self):
+        return (self.start_page, self.end_page, self.start_offset, self.end_offset)
+
+
+class TextUnit:
+    """A sentence, or part of an overlong one, the smallest piece a chunk is built from."""
+
+    def __init__(self, text, page, start, starts_paragraph, tokens=0):
+        self.text = text
+        self.page = page
+        self.start = start
+        self.end = start + len(text)
+        self.starts_paragraph = starts_paragraph
+        self.tokens = tokens
+
+
+class TextChunker:
+    """
+    Splits a stream of pages into chunks measured in tokens of the embeddings model, so
+    no chunk is longer than what the model embeds and no text is silently truncated.
+
+    Chunks are built from whole sentences. A chunk also ends at a paragraph or page
+    boundary once it is at least half full, so chunks follow the structure of the
+    document. A chunk that fills up within a paragraph is followed by one that repeats
+    its last sentences, up to the overlap. Sentences longer than a chunk are split
+    between words.
+
+    The pages are consumed one at a time and the tokens of all the sentences of a page
+    are counted in a single request, so memory does not grow with the document.
+    """
+
+    def __init__(self, count_tokens, chunk_tokens=200, overlap=0.1):
+        """
+        Initialize the text chunker.
+
+        Args:
+            count_tokens (callable): Returns the token counts of a list of texts, without
+                special tokens
+            chunk_tokens (int): Maximum tokens of a chunk
+            overlap (float): Fraction of a chunk repeated at the start of the next one
+                when a chunk ends within a paragraph (0.0 to 1.0)
+        """
+        self.count_tokens = count_tokens
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = int(chunk_tokens * overlap)
+
+    @staticmethod
+    def split_page(page_num, text):
+        """
+        Returns the sentences of a page text, with their offsets in it
+        """
+        units = []
+        paragraph_start = 0
+
+        for paragraph in text.split(PARAGRAPH_SEPARATOR):
+            for i, match in enumerate(SENTENCE_PATTERN.finditer(paragraph)):
+                sentence = match.group().rstrip()
+                units.append(
+                    TextUnit(
+                        sentence, page_num, paragraph_start + match.start(), i == 0
+                    )
+                )
+            paragraph_start += len(paragraph) + len(PARAGRAPH_SEPARATOR)
+
+        return units
+
+    def split_long(self, unit):
+        """
+        Splits a unit longer than a chunk between words into as many parts as the chunk
+        size requires, splitting again any part that still does not fit
+        """
+        if unit.tokens <= self.chunk_tokens:
+            return [unit]
+
+        words = [match.start() for match in WORD_PATTERN.finditer(unit.text)]
+        parts_count = min(len(words), -(-unit.tokens // self.chunk_tokens))
+        if parts_count < 2:
+            return [unit]
+
+        bounds = [words[len(words) * i // parts_count] for i in range(parts_count)]
+        bounds.append(len(unit.text))
+        parts = [
+            TextUnit(
+                unit.text[start:end].rstrip(),
+                unit.page,
+                unit.start + start,
+                unit.starts_paragraph and i == 0,
+            )
+            for i, (start, end) in enumerate(zip(bounds, bounds[1:]))
+        ]
+        for part, tokens in zip(parts, self.count_tokens([p.text for p in parts])):
+            part.tokens = tokens
+
+        return [piece for part in parts for piece in self.split_long(part)]
+
+    @staticmethod
+    def make_chunk(units):
+        parts = []
+        for i, unit in enumerate(units):
+            if i:
+                parts.append(PARAGRAPH_SEPARATOR if unit.starts_paragraph else " ")
+            parts.append(unit.text)
+
+        return Chunk(
+            "".join(parts),
+            units[0].page,
+            units[-1].page,
+            units[0].start,
+            units[-1].end,
+            sum(unit.tokens for unit in units),
+        )
+
+    def overlap(self, units):
+        """
+        Returns the last units of a chunk that fit in the overlap
+        """
+        kept = []
+        tokens = 0
+        for unit in reversed(units):
+            if tokens + unit.tokens > self.overlap_tokens:
+                break
+            kept.insert(0, unit)
+            tokens += unit.tokens
+        return kept
+
+    def chunks(self, pages):
+        """
+        Yields the chunks of a document as soon as they are complete.
+
+        Args:
+            pages (Iterable[Tuple[int, str]]): Page numbers and texts, with paragraphs
+                separated by a blank line
+
+        Yields:
+            Chunk: Chunks in document order
+        """
+        current = []
+        tokens = 0
+
+        for page_num, text in pages:
+            units = self.split_page(page_num, text)
+            if not units:
+                continue
+
+            # A new page starts a paragraph
+            units[0].starts_paragraph = True
+            for unit, count in zip(units, self.count_tokens([u.text for u in units])):
+                unit.tokens = count
+
+                for piece in self.split_long(unit):
+                    full = tokens + piece.tokens > self.chunk_tokens
+                    at_boundary = (
+                        piece.starts_paragraph and tokens >= self.chunk_tokens // 2
+                    )
+
+                    if current and (full or at_boundary):
+                        yield self.make_chunk(current)
+
+                        # Overlap only continues a paragraph that was cut
+                        current = (
+                            [] if piece.starts_paragraph else self.overlap(current)
+                        )
+                        tokens = sum(u.tokens for u in current)
+                        while current and tokens + piece.tokens > self.chunk_tokens:
+                            tokens -= current.pop(0).tokens
+
+                    current.append(piece)
+                    tokens += piece.tokens
+
+        if current:
+            yield self.make_chunk(current)
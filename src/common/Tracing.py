@@ -0,0 +1,237 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import logging
+import json
+import time
+import uuid
+
+# Header carrying the request id from the client to the applications and the embeddings service
+REQUEST_ID_HEADER = "X-Request-Id"
+
+# Trace and span of the request handled by the current greenlet
+current_trace = ContextVar("current_trace", default=None)
+current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed stage of a request with its attributes."""
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.parent = None
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.trace.spans.append(self)
+
+    def to_dict(self):
+        return {
+            "request_id": self.trace.request_id,
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": self.trace.tracer.service_name,
+            "start_ns": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                otlp_attribute(key, value) for key, value in self.attributes.items()
+            ],
+            "status": (
+                {"code": 2, "message": self.error} if self.error else {"code": 1}
+            ),
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Trace:
+    """The spans of one request, exported together once its response is closed."""
+
+    def __init__(self, tracer, name, request_id):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = request_id or self.trace_id
+        self.spans = []
+        self.root = Span(self, name)
+        self.root.set_attribute("request_id", self.request_id)
+
+    def finish(self):
+        """
+        Ends the root span, exports the trace and detaches it from the current greenlet
+        """
+        if self.root.end_ns is not None:
+            return
+        self.root.end()
+        if current_trace.get() is self:
+            current_trace.set(None)
+            current_span.set(None)
+        self.tracer.export(self)
+
+
+class Tracer:
+    """
+    Request-scoped tracing. The spans of a request are collected in memory and appended
+    to a local file when the request finishes, either one JSON line per span ("jsonl")
+    or one OTLP/JSON ExportTraceServiceRequest line per request ("otlp"). When tracing is
+    disabled no trace is started and span() does nothing.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.enabled = False
+        self.service_name = ""
+        self.export_format = "jsonl"
+        self.file = None
+        self.lock = threading.Lock()
+
+    def configure(self, service_name, export_path, export_format="jsonl"):
+        """
+        Enables tracing.
+
+        Args:
+            service_name (str): Name of the application, recorded on every span
+            export_path (str): File the traces are appended to
+            export_format (str): jsonl or otlp
+        """
+        if export_format not in ("jsonl", "otlp"):
+            raise ValueError(f"Unsupported trace export format: {export_format}")
+
+        self.service_name = service_name
+        self.export_format = export_format
+        self.file = open(export_path, "a", encoding="utf-8")
+        self.enabled = True
+
+    def start_trace(self, name, request_id=None):
+        """
+        Starts the trace of a request in the current greenlet; returns None when tracing
+        is disabled. The caller finishes it once the response has been sent.
+        """
+        if not self.enabled:
+            return None
+
+        trace = Trace(self, name, request_id)
+        current_trace.set(trace)
+        current_span.set(trace.root)
+        return trace
+
+    def start_span(self, name, **attributes):
+        """
+        Starts a child of the current span and makes it current; returns None outside a
+        trace. Every started span must be passed to end_span.
+        """
+        trace = current_trace.get()
+        if trace is None:
+            return None
+
+        parent = current_span.get() or trace.root
+        span = Span(trace, name, parent.span_id, attributes)
+        span.parent = parent
+        current_span.set(span)
+        return span
+
+    def end_span(self, span):
+        if span is None:
+            return
+        current_span.set(span.parent)
+        span.end()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Times the with block as a child of the current span; yields the span, or None
+        outside a trace
+        """
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            if span is not None:
+                span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.end_span(span)
+
+    def export(self, trace):
+        if self.export_format == "otlp":
+            lines = [
+                json.dumps(
+                    {
+                        "resourceSpans": [
+                            {
+                                "resource": {
+                                    "attributes": [
+                                        otlp_attribute(
+                                            "service.name", self.service_name
+                                        )
+                                    ]
+                                },
+                                "scopeSpans": [
+                                    {
+                                        "scope": {"name": __name__},
+                                        "spans": [
+                                            span.to_otlp() for span in trace.spans
+                                        ],
+                                    }
+                                ],
+                            }
+                        ]
+                    }
+                )
+            ]
+        else:
+            lines = [json.dumps(span.to_dict()) for span in trace.spans]
+
+        try:
+            with self.lock:
+                self.file.write("\n".join(lines) + "\n")
+                self.file.flush()
+        except OSError as e:
+            self.logger.warning(f"Trace export failed: {e}")
+
+
+def current_request_id():
+    trace = current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+# Tracer of the process; applications enable it with TRACER.configure
+TRACER = Tracer()
@@ -3,14 +3,25 @@
 #
 import psycopg2
 from psycopg2.extensions import register_adapter, AsIs
+from psycopg2.extras import execute_values
 import numpy as np
 import boto3
 import json
 import configparser
 import logging
+import time
+from common.ConnectionPool import ConnectionPool
+from common.Tracing import TRACER
+from common.VectorStore import (
+    VectorStore,
+    VECTOR_SEARCH_LATENCY,
+    VECTOR_INSERT_LATENCY,
+)
 
 
-class VectorDatabase:
+class VectorDatabase(VectorStore):
+    """Vector store on RDS PostgreSQL with the pgvector extension."""
+
     def __init__(self, configfile_name):
         self.logger = logging.getLogger(__name__)
         # ----------------------------------------------------------------------------------------------------------------------
@@ -24,20 +35,38 @@ class VectorDatabase:
         self.DBNAME = config.get("RDS_Connection", "db_name")
         self.HOST = config.get("RDS_Connection", "host")
         self.PORT = config.getint("RDS_Connection", "port")
+        self.SECRET_TTL = config.getint("RDS_Connection", "SecretTTL")
 
         register_adapter(np.ndarray, self.adapt_numpy_array)
 
+        # Secrets Manager client and credentials are cached across connections
+        self.secrets_client = None
+        self.credentials = None
+        self.credentials_expiry = 0.0
+
+        self.pool = ConnectionPool(
+            self.connect,
+            min_size=config.getint("RDS_Connection", "PoolMinSize"),
+            max_size=config.getint("RDS_Connection", "PoolMaxSize"),
+            acquire_timeout=config.getfloat("RDS_Connection", "PoolAcquireTimeout"),
+            idle_timeout=config.getfloat("RDS_Connection", "PoolIdleTimeout"),
+            health_check_interval=config.getfloat(
+                "RDS_Connection", "PoolHealthCheckInterval"
+            ),
+        )
+
     def get_secret(self):
         """
         Get secret information from AWS Secrets Manager
         """
         try:
-            session = boto3.session.Session()
-            client = session.client(
-                service_name="secretsmanager", region_name=self.REGION_NAME
-            )
+            if self.secrets_client is None:
+                session = boto3.session.Session()
+                self.secrets_client = session.client(
+                    service_name="secretsmanager", region_name=self.REGION_NAME
+                )
 
-            get_secret_value_response = client.get_secret_value(
+            get_secret_value_response = self.secrets_client.get_secret_value(
                 SecretId=self.SECRET_NAME
             )
         except Exception as e:
@@ -64,12 +93,35 @@ class VectorDatabase:
             "port": None,
         }
 
+    def get_credentials(self, refresh=False):
+        """
+        Returns the database credentials, fetching them from Secrets Manager only when the
+        cached copy has expired or a refresh is requested
+        """
+        expired = time.monotonic() >= self.credentials_expiry
+        if refresh or expired or self.credentials is None:
+            with TRACER.span("secret_fetch", refresh=refresh):
+                self.credentials = self.get_secret()
+            self.credentials_expiry = time.monotonic() + self.SECRET_TTL
+
+        return self.credentials
+
+    def connect(self):
+        """
+        Opens a new database connection with the cached credentials, refreshing them once
+        in case the secret has been rotated
+        """
+        try:
+            return psycopg2.connect(**self.get_credentials())
+        except psycopg2.OperationalError as e:
+            self.logger.warning(f"Connection failed, refreshing credentials: {e}")
+            return psycopg2.connect(**self.get_credentials(refresh=True))
+
     def get_db_connection(self):
         """
         Creates a database connection using credentials from Secrets Manager
         """
-        db_credentials = self.get_secret()
-        return psycopg2.connect(**db_credentials)
+        return self.connect()
 
     @staticmethod
     def adapt_numpy_array(numpy_array):
@@ -84,48 +136,80 @@ class VectorDatabase:
         """
 
         try:
-            conn = self.get_db_connection()
-            cur = conn.cursor()
-
-            # Create the vector extension if it doesn't exist
-            cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-
-            # Create the table
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS text_embeddings (
-                    id SERIAL PRIMARY KEY,
-                    text TEXT NOT NULL,
-                    embedding vector(384),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                );
-            """
-            )
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    # Create the vector extension if it doesn't exist
+                    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
 
-            # Create an index for better vector similarity search performance
-            cur.execute(
-                """
-                CREATE INDEX IF NOT EXISTS text_embeddings_embedding_idx
-                ON text_embeddings
-                USING ivfflat (embedding vector_cosine_ops)
-                WITH (lists = 100);
-            """
-            )
+                    # Create the table
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS text_embeddings (
+                            id SERIAL PRIMARY KEY,
+                            text TEXT NOT NULL,
+                            embedding vector(384),
+                            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                            source TEXT,
+                            document_hash CHAR(64),
+                            chunk_hash CHAR(64),
+                            page_start INTEGER,
+                            page_end INTEGER,
+                            start_offset INTEGER,
+                            end_offset INTEGER
+                        );
+                    """
+                    )
 
-            conn.commit()
+                    # Content hash columns for tables created before deduplication
+                    cur.execute(
+                        """
+                        ALTER TABLE text_embeddings
+                        ADD COLUMN IF NOT EXISTS source TEXT,
+                        ADD COLUMN IF NOT EXISTS document_hash CHAR(64),
+                        ADD COLUMN IF NOT EXISTS chunk_hash CHAR(64);
+                    """
+                    )
+
+                    # Location columns for tables created before token-aware chunking
+                    cur.execute(
+                        """
+                        ALTER TABLE text_embeddings
+                        ADD COLUMN IF NOT EXISTS page_start INTEGER,
+                        ADD COLUMN IF NOT EXISTS page_end INTEGER,
+                        ADD COLUMN IF NOT EXISTS start_offset INTEGER,
+                        ADD COLUMN IF NOT EXISTS end_offset INTEGER;
+                    """
+                    )
+                    cur.execute(
+                        """
+                        CREATE INDEX IF NOT EXISTS text_embeddings_document_hash_idx
+                        ON text_embeddings (document_hash);
+                    """
+                    )
+                    cur.execute(
+                        """
+                        CREATE INDEX IF NOT EXISTS text_embeddings_source_chunk_hash_idx
+                        ON text_embeddings (source, chunk_hash);
+                    """
+                    )
+
+                    # Create an index for better vector similarity search performance
+                    cur.execute(
+                        """
+                        CREATE INDEX IF NOT EXISTS text_embeddings_embedding_idx
+                        ON text_embeddings
+                        USING ivfflat (embedding vector_cosine_ops)
+                        WITH (lists = 100);
+                    """
+                    )
+
+                conn.commit()
             print("Table and index created successfully!")
 
         except Exception as e:
             error_message = f"An error occurred: {e}"
             print(error_message)
             self.logger.error(error_message)
-            if conn:
-                conn.rollback()
-        finally:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
 
     def insert_text_and_embedding(self, text, vector_embeddings):
         """
@@ -134,20 +218,19 @@ class VectorDatabase:
         try:
             embedding = np.array(vector_embeddings)
 
-            conn = self.get_db_connection()
-            cur = conn.cursor()
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        INSERT INTO text_embeddings (text, embedding)
+                        VALUES (%s, %s)
+                        RETURNING id;
+                    """,
+                        (text, embedding),
+                    )
 
-            cur.execute(
-                """
-                INSERT INTO text_embeddings (text, embedding)
-                VALUES (%s, %s)
-                RETURNING id;
-            """,
-                (text, embedding),
-            )
-
-            inserted_id = cur.fetchone()[0]
-            conn.commit()
+                    inserted_id = cur.fetchone()[0]
+                conn.commit()
             print(f"Successfully inserted with ID: {inserted_id}")
             return inserted_id
 
@@ -156,35 +239,191 @@ class VectorDatabase:
             print(error_message)
             self.logger.error(error_message)
 
-            if conn:
-                conn.rollback()
             return None
-        finally:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
+
+    def insert_many(
+        self,
+        texts,
+        vector_embeddings,
+        page_size=500,
+        source=None,
+        chunk_hashes=None,
+        locations=None,
+    ):
+        """
+        Inserts many texts and their embeddings in a single transaction. The rows are
+        inserted with their ordinal into a temporary staging table, using multi-row INSERT
+        statements of up to page_size rows, and take their ids from the table sequence
+        there; they are then moved to text_embeddings in one statement. Returns the new
+        ids in input order. The rows can be tagged with their source document, chunk
+        content hashes and locations in the document.
+        """
+        if len(texts) != len(vector_embeddings):
+            raise ValueError(
+                f"Got {len(texts)} texts but {len(vector_embeddings)} embeddings"
+            )
+
+        if not len(texts):
+            return []
+
+        if chunk_hashes is None:
+            chunk_hashes = [None] * len(texts)
+        if locations is None:
+            locations = [(None, None, None, None)] * len(texts)
+
+        try:
+            embeddings = np.asarray(vector_embeddings, dtype=np.float32)
+            staged_rows = [
+                (ordinal, text, embedding, source, chunk_hash, *location)
+                for ordinal, text, embedding, chunk_hash, location in zip(
+                    range(len(texts)), texts, embeddings, chunk_hashes, locations
+                )
+            ]
+
+            with VECTOR_INSERT_LATENCY.time(), self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    # Kept by the connection for its next inserts, emptied on commit
+                    cur.execute(
+                        """
+                        CREATE TEMPORARY TABLE IF NOT EXISTS text_embeddings_staging (
+                            id INTEGER NOT NULL DEFAULT
+                                nextval(pg_get_serial_sequence('text_embeddings', 'id')),
+                            ordinal INTEGER NOT NULL,
+                            text TEXT NOT NULL,
+                            embedding vector,
+                            source TEXT,
+                            chunk_hash TEXT,
+                            page_start INTEGER,
+                            page_end INTEGER,
+                            start_offset INTEGER,
+                            end_offset INTEGER
+                        ) ON COMMIT DELETE ROWS;
+                    """
+                    )
+                    execute_values(
+                        cur,
+                        """
+                        INSERT INTO text_embeddings_staging (
+                            ordinal, text, embedding, source, chunk_hash,
+                            page_start, page_end, start_offset, end_offset
+                        )
+                        VALUES %s;
+                    """,
+                        staged_rows,
+                        page_size=page_size,
+                    )
+                    cur.execute(
+                        """
+                        INSERT INTO text_embeddings (
+                            id, text, embedding, source, chunk_hash,
+                            page_start, page_end, start_offset, end_offset
+                        )
+                        SELECT
+                            id, text, embedding, source, chunk_hash,
+                            page_start, page_end, start_offset, end_offset
+                        FROM text_embeddings_staging;
+                    """
+                    )
+                    cur.execute(
+                        """
+                        SELECT id FROM text_embeddings_staging ORDER BY ordinal;
+                    """
+                    )
+                    rows = cur.fetchall()
+                conn.commit()
+
+            inserted_ids = [row[0] for row in rows]
+            print(f"Successfully inserted {len(inserted_ids)} rows")
+            return inserted_ids
+
+        except Exception as e:
+            self.logger.error(f"Could not insert {len(texts)} rows: {e}")
+            raise
+
+    def document_exists(self, document_hash):
+        """
+        Checks whether a document with this content hash has been fully ingested
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT 1 FROM text_embeddings
+                    WHERE document_hash = %s
+                    LIMIT 1;
+                """,
+                    (document_hash,),
+                )
+                return cur.fetchone() is not None
+
+    def get_chunk_hashes(self, source):
+        """
+        Returns the content hashes of the chunks already stored for a source document
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT DISTINCT chunk_hash FROM text_embeddings
+                    WHERE source = %s AND chunk_hash IS NOT NULL;
+                """,
+                    (source,),
+                )
+                return {row[0] for row in cur.fetchall()}
+
+    def finalize_document(self, source, document_hash, chunk_hashes):
+        """
+        Marks the chunks of the current version of a document with its content hash and
+        deletes the chunks of previous versions that are no longer part of it.
+        Returns the number of deleted rows.
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM text_embeddings
+                    WHERE source = %s
+                    AND (chunk_hash IS NULL OR NOT chunk_hash = ANY(%s));
+                """,
+                    (source, list(chunk_hashes)),
+                )
+                deleted_rows = cur.rowcount
+
+                cur.execute(
+                    """
+                    UPDATE text_embeddings
+                    SET document_hash = %s
+                    WHERE source = %s;
+                """,
+                    (document_hash, source),
+                )
+            conn.commit()
+
+        return deleted_rows
 
     def search_similar_texts(self, query_embedding, limit=5, similarity_threshold=0.8):
         """
         Searches for similar texts using vector similarity
         """
         try:
-            conn = self.get_db_connection()
-            cur = conn.cursor()
-
-            cur.execute(
-                """
-                SELECT text, 1 - (embedding <=> %s) as similarity
-                FROM text_embeddings
-                WHERE 1 - (embedding <=> %s) > %s
-                ORDER BY similarity DESC
-                LIMIT %s;
-            """,
-                (query_embedding, query_embedding, similarity_threshold, limit),
-            )
+            with VECTOR_SEARCH_LATENCY.time(), TRACER.span(
+                "vector_search", limit=limit, backend="pgvector"
+            ), self.pool.connection() as conn:
+                with conn.cursor() as cur, TRACER.span("sql") as span:
+                    cur.execute(
+                        """
+                        SELECT text, 1 - (embedding <=> %s) as similarity
+                        FROM text_embeddings
+                        WHERE 1 - (embedding <=> %s) > %s
+                        ORDER BY similarity DESC
+                        LIMIT %s;
+                    """,
+                        (query_embedding, query_embedding, similarity_threshold, limit),
+                    )
 
-            results = cur.fetchall()
+                    results = cur.fetchall()
+                    if span is not None:
+                        span.set_attribute("rows", len(results))
             return results
 
         except Exception as e:
@@ -193,6 +432,3 @@ class VectorDatabase:
             self.logger.error(error_message)
 
             return []
-        finally:
-            if conn:
-                conn.close()
@@ -1,8 +1,27 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 #
-import requests
+import numpy as np
 import configparser
+import time
+from common.EmbeddingCache import EmbeddingCache
+from common.HttpSession import get_http_session
+from common.Metrics import REGISTRY
+from common.Tracing import TRACER, REQUEST_ID_HEADER, current_request_id
+
+EMBEDDING_LATENCY = REGISTRY.histogram(
+    "embedding_request_seconds",
+    "Seconds to get the embeddings of a text or a batch of texts",
+    ["operation"],
+)
+
+# Wire formats supported by the embeddings service and the Accept header that requests them
+WIRE_FORMATS = {
+    "json": "application/json",
+    "float32": "application/x-float32",
+    "float16": "application/x-float16",
+}
+BINARY_DTYPES = {"application/x-float32": "<f4", "application/x-float16": "<f2"}
 
 
 class VectorEmbeddings:
@@ -15,23 +34,177 @@ class VectorEmbeddings:
         self.VECTOR_EMBEDDINGS_URL = config.get(
             "VectorEmbeddings", "VectorEmbeddingsURL"
         )
+        self.VECTOR_EMBEDDINGS_BATCH_URL = config.get(
+            "VectorEmbeddings", "VectorEmbeddingsBatchURL"
+        )
+        self.VECTOR_EMBEDDINGS_COUNT_TOKENS_URL = config.get(
+            "VectorEmbeddings", "VectorEmbeddingsCountTokensURL"
+        )
+        self.MAX_BATCH_SIZE = config.getint("VectorEmbeddings", "MaxBatchSize")
+        self.MAX_COUNT_BATCH_SIZE = config.getint(
+            "VectorEmbeddings", "MaxCountBatchSize"
+        )
         self.TIMEOUT = config.getint("VectorEmbeddings", "Timeout")
+        self.WIRE_FORMAT = config.get("VectorEmbeddings", "WireFormat")
+
+        if self.WIRE_FORMAT not in WIRE_FORMATS:
+            raise ValueError(f"Unsupported embeddings wire format: {self.WIRE_FORMAT}")
+
+        self.headers = {"Accept": WIRE_FORMATS[self.WIRE_FORMAT]}
+        self.http = get_http_session(configfile_name)
+
+        # Cache of single-text (query) embeddings
+        self.cache = None
+        if config.getboolean("VectorEmbeddings", "CacheEnabled"):
+            self.cache = EmbeddingCache(
+                max_size=config.getint("VectorEmbeddings", "CacheSize"),
+                ttl=config.getfloat("VectorEmbeddings", "CacheTTL"),
+                shared_path=config.get("VectorEmbeddings", "SharedCachePath"),
+                shared_max_size=config.getint("VectorEmbeddings", "SharedCacheSize"),
+            )
+
+    @staticmethod
+    def decode_binary_embeddings(response):
+        """
+        Decodes a raw little-endian float32/float16 body into a NumPy array.
+        float32 bodies are wrapped without copying; float16 bodies are widened to float32.
+        """
+        mimetype = response.headers.get("Content-Type", "").split(";")[0].strip()
+        shape = tuple(
+            int(dim) for dim in response.headers["X-Embeddings-Shape"].split(",")
+        )
+
+        embeddings = np.frombuffer(
+            response.content, dtype=BINARY_DTYPES[mimetype]
+        ).reshape(shape)
+
+        if embeddings.dtype != np.float32:
+            embeddings = embeddings.astype(np.float32)
+
+        return embeddings
+
+    def parse_response(self, response):
+        """
+        Returns the embeddings of a response in whichever format the service answered with
+        """
+        mimetype = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if mimetype in BINARY_DTYPES:
+            return self.decode_binary_embeddings(response)
+
+        # Parse the JSON response
+        result = response.json()
+
+        if "success" not in result:
+            raise ValueError(result.get("error"))
+
+        return np.asarray(result["embeddings"], dtype=np.float32)
+
+    def request_headers(self):
+        """
+        Headers of an embeddings request, carrying the id of the request being traced
+        """
+        request_id = current_request_id()
+        if request_id is None:
+            return self.headers
+        return {**self.headers, REQUEST_ID_HEADER: request_id}
 
     def get_vector_embeddings(self, text_data):
-        response = requests.post(
-            self.VECTOR_EMBEDDINGS_URL, json={"text": text_data}, timeout=self.TIMEOUT
+        with TRACER.span("embedding") as span:
+            embeddings = self.fetch_vector_embeddings(text_data, span)
+        return embeddings
+
+    def fetch_vector_embeddings(self, text_data, span=None):
+        start = time.perf_counter()
+
+        if self.cache is not None:
+            embeddings = self.cache.get(text_data)
+            if embeddings is not None:
+                EMBEDDING_LATENCY.observe(
+                    time.perf_counter() - start, operation="cache_hit"
+                )
+                if span is not None:
+                    span.set_attribute("cache_hit", True)
+                return embeddings
+
+        if span is not None:
+            span.set_attribute("cache_hit", False)
+
+        response = self.http.post(
+            self.VECTOR_EMBEDDINGS_URL,
+            self.TIMEOUT,
+            json={"text": text_data},
+            headers=self.request_headers(),
         )
 
         # Check for HTTP errors
         response.raise_for_status()
 
-        # Parse the JSON response
-        result = response.json()
+        try:
+            embeddings = self.parse_response(response)
+        except ValueError as e:
+            print("Error:", e)
+            return str(e)
+
+        if self.cache is not None:
+            self.cache.put(text_data, embeddings)
+
+        EMBEDDING_LATENCY.observe(time.perf_counter() - start, operation="single")
+        return embeddings
+
+    def get_vector_embeddings_batch(self, texts):
+        """
+        Gets the embeddings of several texts, sending at most MAX_BATCH_SIZE texts per request
+        """
+        embeddings = []
+
+        for start in range(0, len(texts), self.MAX_BATCH_SIZE):
+            batch = texts[start : start + self.MAX_BATCH_SIZE]
+            with EMBEDDING_LATENCY.time(operation="batch"):
+                response = self.http.post(
+                    self.VECTOR_EMBEDDINGS_BATCH_URL,
+                    self.TIMEOUT,
+                    json={"texts": batch},
+                    headers=self.request_headers(),
+                )
+
+                # Check for HTTP errors
+                response.raise_for_status()
+
+                embeddings.append(self.parse_response(response))
+
+        if not embeddings:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # A single request keeps the zero-copy view over the response body
+        if len(embeddings) == 1:
+            return embeddings[0]
+
+        return np.concatenate(embeddings)
+
+    def count_tokens(self, texts):
+        """
+        Counts the tokens of several texts with the tokenizer of the embeddings model,
+        sending at most MAX_COUNT_BATCH_SIZE texts per request
+        """
+        counts = []
+
+        for start in range(0, len(texts), self.MAX_COUNT_BATCH_SIZE):
+            batch = texts[start : start + self.MAX_COUNT_BATCH_SIZE]
+            with EMBEDDING_LATENCY.time(operation="count_tokens"):
+                response = self.http.post(
+                    self.VECTOR_EMBEDDINGS_COUNT_TOKENS_URL,
+                    self.TIMEOUT,
+                    json={"texts": batch},
+                    headers=self.request_headers(),
+                )
+
+                # Check for HTTP errors
+                response.raise_for_status()
+
+                result = response.json()
+                if "success" not in result:
+                    raise ValueError(result.get("error"))
 
-        if "success" in result:
-            print("Embeddings:", result["embeddings"])
-        else:
-            print("Error:", result.get("error"))
-            return result.get("error")
+                counts.extend(result["counts"])
 
-        return result["embeddings"]
+        return counts
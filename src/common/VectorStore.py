@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from common.Metrics import REGISTRY
+import configparser
+
+VECTOR_SEARCH_LATENCY = REGISTRY.histogram(
+    "vector_search_seconds",
+    "Seconds to search the vector store for similar texts, including the pool wait",
+)
+VECTOR_INSERT_LATENCY = REGISTRY.histogram(
+    "vector_insert_seconds",
+    "Seconds to insert a batch of texts and embeddings, including the pool wait",
+)
+
+
+class VectorStore:
+    """
+    Interface of the stores the knowledge base chunks and their embeddings are kept in.
+    VectorDatabase implements it on RDS PostgreSQL with pgvector, LocalVectorStore and
+    BruteForceVectorStore on files of the local instance.
+    """
+
+    def create_vector_table(self):
+        """
+        Creates the storage of the chunks if it does not exist yet
+        """
+        raise NotImplementedError
+
+    def insert_text_and_embedding(self, text, vector_embeddings):
+        """
+        Inserts a text and its embedding; returns the new id, or None on error
+        """
+        raise NotImplementedError
+
+    def insert_many(
+        self,
+        texts,
+        vector_embeddings,
+        page_size=500,
+        source=None,
+        chunk_hashes=None,
+        locations=None,
+    ):
+        """
+        Inserts many texts and their embeddings, optionally tagged with their source
+        document, chunk content hashes and (start page, end page, start offset, end
+        offset) locations in the document. Stores that write with SQL statements send at
+        most page_size rows per statement. Returns the new ids in input order; errors
+        are raised.
+        """
+        raise NotImplementedError
+
+    def document_exists(self, document_hash):
+        """
+        Checks whether a document with this content hash has been fully ingested
+        """
+        raise NotImplementedError
+
+    def get_chunk_hashes(self, source):
+        """
+        Returns the content hashes of the chunks already stored for a source document
+        """
+        raise NotImplementedError
+
+    def finalize_document(self, source, document_hash, chunk_hashes):
+        """
+        Marks the chunks of the current version of a document with its content hash and
+        deletes the chunks of previous versions. Returns the number of deleted chunks.
+        """
+        raise NotImplementedError
+
+    def search_similar_texts(self, query_embedding, limit=5, similarity_threshold=0.8):
+        """
+        Returns up to limit (text, cosine similarity) pairs above the threshold, most
+        similar first
+        """
+        raise NotImplementedError
+
+    def search_similar_texts_batch(
+        self, query_embeddings, limit=5, similarity_threshold=0.8
+    ):
+        """
+        Searches for the texts similar to each of several queries; returns one list of
+        (text, cosine similarity) pairs per query
+        """
+        return [
+            self.search_similar_texts(query_embedding, limit, similarity_threshold)
+            for query_embedding in query_embeddings
+        ]
+
+
+def create_vector_store(configfile_name):
+    """
+    Creates the vector store selected by the Backend option of the VectorStore section
+    """
+    config = configparser.ConfigParser()
+    config.read(configfile_name)
+    backend = config.get("VectorStore", "Backend")
+
+    # Backends are imported on demand so the local one does not need the RDS dependencies
+    if backend == "pgvector":
+        from common.VectorDatabase import VectorDatabase
+
+        return VectorDatabase(configfile_name)
+    if backend == "local":
+        from common.LocalVectorStore import LocalVectorStore
+
+        return LocalVectorStore(configfile_name)
+    if backend == "exact":
+        from common.LocalVectorStore import BruteForceVectorStore
+
+        return BruteForceVectorStore(configfile_name)
+
+    raise ValueError(f"Unsupported vector store backend: {backend}")
@@ -6,14 +6,24 @@ import gevent.monkey
 gevent.monkey.patch_all()
 
 from gevent.pywsgi import WSGIServer
-from flask import Flask, request, jsonify
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Empty
+import gevent
+from flask import Flask, request, jsonify, Response
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import json
 import os
+import sys
+import time
 import logging
 from flask_wtf.csrf import CSRFProtect
 
+# The shared metrics module lives in src/common in the repository and is copied to a
+# common folder next to this file on the embeddings instance
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.Metrics import REGISTRY, CONTENT_TYPE, COUNT_BUCKETS
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,6 +37,44 @@ app.config["WTF_CSRF_ENABLED"] = True
 SECRET_KEY = os.urandom(32)
 app.config["SECRET_KEY"] = SECRET_KEY
 
+# Media types for raw little-endian embedding bodies, negotiated via the Accept header
+JSON_MIMETYPE = "application/json"
+FLOAT32_MIMETYPE = "application/x-float32"
+FLOAT16_MIMETYPE = "application/x-float16"
+BINARY_DTYPES = {FLOAT32_MIMETYPE: "<f4", FLOAT16_MIMETYPE: "<f2"}
+
+# Maximum number of texts accepted by a single /get_embeddings_batch request
+MAX_BATCH_SIZE = int(os.environ.get("EMBEDDINGS_MAX_BATCH_SIZE", "64"))
+
+# Maximum number of texts accepted by a single /count_tokens request; tokenizing is cheap
+MAX_COUNT_BATCH_SIZE = int(os.environ.get("EMBEDDINGS_MAX_COUNT_BATCH_SIZE", "1024"))
+
+# Micro-batching of concurrent /get_embeddings requests
+MICRO_BATCH_SIZE = int(os.environ.get("EMBEDDINGS_MICRO_BATCH_SIZE", "32"))
+MICRO_BATCH_WINDOW_MS = float(os.environ.get("EMBEDDINGS_MICRO_BATCH_WINDOW_MS", "5"))
+
+
+# Header carrying the id of the application request an embeddings request belongs to
+REQUEST_ID_HEADER = "X-Request-Id"
+
+# Latency of the endpoints and of the model forward passes
+REQUEST_LATENCY = REGISTRY.histogram(
+    "embeddings_request_seconds",
+    "Seconds to serve an embeddings request, including the micro-batching wait",
+    ["endpoint"],
+)
+ENCODE_LATENCY = REGISTRY.histogram(
+    "embeddings_encode_seconds",
+    "Seconds spent in a batched model forward pass",
+    ["source"],
+)
+ENCODE_BATCH_SIZE = REGISTRY.histogram(
+    "embeddings_encode_batch_size",
+    "Texts encoded per model forward pass",
+    ["source"],
+    buckets=COUNT_BUCKETS,
+)
+
 
 # Custom JSON encoder to handle numpy arrays
 class NumpyEncoder(json.JSONEncoder):
@@ -47,6 +95,144 @@ except Exception as e:
     model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
 
 
+class MicroBatcher:
+    """
+    Collects single-text encode requests that arrive within a short window and runs
+    them as one batched model.encode call, handing each caller its own vector.
+    """
+
+    def __init__(self, encoder, max_batch_size, window_ms):
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self.queue = Queue()
+
+        # Metrics
+        self.requests = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_batch_size_seen = 0
+        self.batch_size_counts = {}
+
+        self.worker = gevent.spawn(self._run)
+
+    def encode(self, text):
+        """
+        Queues a text and blocks the calling greenlet until its embedding is ready
+        """
+        result = AsyncResult()
+        self.queue.put((text, result))
+        return result.get()
+
+    def _collect_batch(self):
+        # Block until the first request arrives, then keep collecting until the
+        # window closes or the batch is full
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+
+            try:
+                with ENCODE_LATENCY.time(source="micro_batch"):
+                    embeddings = self.encoder(texts)
+                ENCODE_BATCH_SIZE.observe(len(texts), source="micro_batch")
+            except Exception as e:
+                logger.warning(f"Error encoding batch of {len(texts)} texts: {e}")
+                for _, result in batch:
+                    result.set_exception(e)
+                continue
+
+            for (_, result), embedding in zip(batch, embeddings):
+                result.set(embedding)
+
+            self._record_batch(len(batch))
+
+    def _record_batch(self, batch_size):
+        self.requests += batch_size
+        self.batches += 1
+        self.last_batch_size = batch_size
+        self.max_batch_size_seen = max(self.max_batch_size_seen, batch_size)
+        self.batch_size_counts[batch_size] = (
+            self.batch_size_counts.get(batch_size, 0) + 1
+        )
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "requests": self.requests,
+            "batches": self.batches,
+            "average_batch_size": (
+                self.requests / self.batches if self.batches else 0.0
+            ),
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size_seen,
+            "batch_size_counts": {
+                str(size): count
+                for size, count in sorted(self.batch_size_counts.items())
+            },
+            "config": {
+                "micro_batch_size": self.max_batch_size,
+                "window_ms": self.window * 1000.0,
+            },
+        }
+
+
+micro_batcher = MicroBatcher(
+    lambda texts: model.encode(texts, batch_size=len(texts)),
+    max_batch_size=MICRO_BATCH_SIZE,
+    window_ms=MICRO_BATCH_WINDOW_MS,
+)
+
+
+def embeddings_response(embeddings):
+    """
+    Returns the embeddings as JSON or, when the client accepts it, as a raw little-endian
+    float32/float16 body with the array shape in the X-Embeddings-Shape header
+    """
+    mimetype = request.accept_mimetypes.best_match(
+        [JSON_MIMETYPE, FLOAT32_MIMETYPE, FLOAT16_MIMETYPE], default=JSON_MIMETYPE
+    )
+
+    if mimetype not in BINARY_DTYPES:
+        return jsonify(
+            {
+                "success": True,
+                "embeddings": embeddings.tolist(),  # Convert numpy array to list
+            }
+        )
+
+    body = np.ascontiguousarray(embeddings, dtype=BINARY_DTYPES[mimetype])
+    return Response(
+        body.tobytes(),
+        mimetype=mimetype,
+        headers={"X-Embeddings-Shape": ",".join(map(str, body.shape))},
+    )
+
+
+# Echo the request id so that client and service logs of a request can be correlated
+@app.after_request
+def echo_request_id(response):
+    request_id = request.headers.get(REQUEST_ID_HEADER)
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+
 @app.route("/get_embeddings", methods=["POST"])
 @csrf.exempt
 def get_embeddings():
@@ -67,22 +253,145 @@ def get_embeddings():
         if not isinstance(text, str):
             return jsonify({"error": "Text must be a string"}), 400
 
-        embeddings = model.encode(text)
+        # Concurrent requests are grouped into a single batched forward pass
+        with REQUEST_LATENCY.time(endpoint="get_embeddings"):
+            embeddings = micro_batcher.encode(text)
+
+        return embeddings_response(embeddings)
+
+    except Exception as e:
+        # Changed to warning level since we're handling the exception by returning an error response
+        logger.warning(
+            f"Error processing request {request.headers.get(REQUEST_ID_HEADER)}: {e}"
+        )
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/get_embeddings_batch", methods=["POST"])
+@csrf.exempt
+def get_embeddings_batch():
+    try:
+        data = request.get_json()
+
+        if not data or "texts" not in data:
+            return (
+                jsonify(
+                    {
+                        "error": 'No texts provided. Please send a JSON with a "texts" field.'
+                    }
+                ),
+                400,
+            )
+
+        texts = data["texts"]
+        if not isinstance(texts, list) or not all(
+            isinstance(text, str) for text in texts
+        ):
+            return jsonify({"error": "Texts must be a list of strings"}), 400
+
+        if len(texts) > MAX_BATCH_SIZE:
+            return (
+                jsonify(
+                    {
+                        "error": f"Batch size {len(texts)} exceeds the maximum of {MAX_BATCH_SIZE}",
+                        "max_batch_size": MAX_BATCH_SIZE,
+                    }
+                ),
+                413,
+            )
+
+        if not texts:
+            return embeddings_response(
+                np.empty(
+                    (0, model.get_sentence_embedding_dimension()), dtype=np.float32
+                )
+            )
+
+        # One forward pass for the whole batch instead of one per text
+        with REQUEST_LATENCY.time(endpoint="get_embeddings_batch"):
+            with ENCODE_LATENCY.time(source="batch"):
+                embeddings = model.encode(texts, batch_size=len(texts))
+            ENCODE_BATCH_SIZE.observe(len(texts), source="batch")
+
+        return embeddings_response(embeddings)
+
+    except Exception as e:
+        logger.warning(
+            f"Error processing batch request {request.headers.get(REQUEST_ID_HEADER)}: {e}"
+        )
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/count_tokens", methods=["POST"])
+@csrf.exempt
+def count_tokens():
+    """
+    Counts the tokens of each text with the tokenizer of the model, without the special
+    tokens the model adds around every input, and reports the maximum input length beyond
+    which the model truncates
+    """
+    try:
+        data = request.get_json()
+
+        if not data or "texts" not in data:
+            return (
+                jsonify(
+                    {
+                        "error": 'No texts provided. Please send a JSON with a "texts" field.'
+                    }
+                ),
+                400,
+            )
+
+        texts = data["texts"]
+        if not isinstance(texts, list) or not all(
+            isinstance(text, str) for text in texts
+        ):
+            return jsonify({"error": "Texts must be a list of strings"}), 400
+
+        if len(texts) > MAX_COUNT_BATCH_SIZE:
+            return (
+                jsonify(
+                    {
+                        "error": f"Batch size {len(texts)} exceeds the maximum of {MAX_COUNT_BATCH_SIZE}",
+                        "max_batch_size": MAX_COUNT_BATCH_SIZE,
+                    }
+                ),
+                413,
+            )
+
+        with REQUEST_LATENCY.time(endpoint="count_tokens"):
+            input_ids = (
+                model.tokenizer(texts, add_special_tokens=False)["input_ids"]
+                if texts
+                else []
+            )
 
-        # Changed from json.dumps to jsonify
         return jsonify(
             {
                 "success": True,
-                "embeddings": embeddings.tolist(),  # Convert numpy array to list
+                "counts": [len(ids) for ids in input_ids],
+                "max_seq_length": model.max_seq_length,
             }
         )
 
     except Exception as e:
-        # Changed to warning level since we're handling the exception by returning an error response
-        logger.warning(f"Error processing request: {e}")
+        logger.warning(
+            f"Error processing token count request {request.headers.get(REQUEST_ID_HEADER)}: {e}"
+        )
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(micro_batcher.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     http_server = WSGIServer(("", 5050), app)
     logger.info("Starting server on port 5050")
@@ -77,7 +77,10 @@ document.addEventListener('DOMContentLoaded', () => {
         })
         .then(response => response.json())
         .then(data => {
-            if (data.success) {
+            if (data.success && data.job_id) {
+                showStatus('Processing...', '');
+                pollJob(data.job_id);
+            } else if (data.success) {
                 showStatus('File uploaded successfully!', 'success');
             } else {
                 showStatus(data.message || 'Upload failed.', 'error');
@@ -89,6 +92,38 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    function pollJob(jobId) {
+        fetch('/jobs/' + encodeURIComponent(jobId))
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                showStatus(data.message || 'Upload failed.', 'error');
+                return;
+            }
+
+            const job = data.job;
+            if (job.status === 'succeeded') {
+                showStatus('File uploaded successfully!', 'success');
+            } else if (job.status === 'failed') {
+                showStatus(job.message || 'Upload failed.', 'error');
+            } else {
+                const progress = job.progress;
+                if (progress) {
+                    showStatus('Processing... pages: ' + progress.pages_parsed +
+                        ' | chunks embedded: ' + progress.chunks_embedded +
+                        ' | rows written: ' + progress.rows_written, '');
+                } else {
+                    showStatus('Waiting for a free ingestion slot...', '');
+                }
+                setTimeout(() => pollJob(jobId), 1000);
+            }
+        })
+        .catch(error => {
+            showStatus('An error occurred while checking the upload.', 'error');
+            console.error('Error:', error);
+        });
+    }
+
     function showStatus(message, type) {
         uploadStatus.textContent = message;
         uploadStatus.className = type;
@@ -2,6 +2,9 @@
 // SPDX-License-Identifier: MIT-0
 $(document).ready(function() {
     const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+    // Id of this page's session; its requests are served by the same model replica, which
+    // still holds the prompt prefix of the previous request in its cache
+    const sessionId = Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, '0')).join('');
     // Utility function for stable JSON stringification
     function stableJSONStringify(obj) {
         if (typeof JSONStringify !== 'undefined') {
@@ -40,7 +43,8 @@ $(document).ready(function() {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
-                    'X-CSRFToken': csrfToken
+                    'X-CSRFToken': csrfToken,
+                    'X-Session-Id': sessionId
                 },
                 body: stableJSONStringify({
                     message: message,
@@ -49,6 +53,13 @@ $(document).ready(function() {
                 })
             });
 
+            // The server rejects requests when the model is saturated
+            if (response.status === 429 || response.status === 503) {
+                const retryAfter = response.headers.get('Retry-After') || '1';
+                appendToChat('\nThe model is busy, please retry in ' + retryAfter + ' seconds\n', containerId);
+                return;
+            }
+
             const container = document.querySelector('#' + containerId);
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
@@ -21,6 +21,10 @@ function updateMetrics(data, PredictionTime) {
     metricsDiv.appendChild(line3);
 }
 
+// Id of this page's session; its requests are served by the same model replica, which
+// still holds the prompt prefix of the previous request in its cache
+const sessionId = Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, '0')).join('');
+
 function stableJSONStringify(obj) {
     if (typeof JSONStringify !== 'undefined') {
         return JSONStringify(obj);
@@ -50,7 +54,8 @@ async function generate() {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken
+                'X-CSRFToken': csrfToken,
+                'X-Session-Id': sessionId
             },
             body: stableJSONStringify({
                 prompt,
@@ -58,6 +63,13 @@ async function generate() {
             }),
         });
 
+        // The server rejects requests when the model is saturated
+        if (response.status === 429 || response.status === 503) {
+            const retryAfter = response.headers.get('Retry-After') || '1';
+            output.value += 'The model is busy, please retry in ' + retryAfter + ' seconds.\n\n';
+            return;
+        }
+
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let buffer = '';
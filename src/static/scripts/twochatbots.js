@@ -2,6 +2,9 @@
 // SPDX-License-Identifier: MIT-0
 $(document).ready(function() {
     const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+    // Id of this page's session; its requests are served by the same model replica, which
+    // still holds the prompt prefix of the previous request in its cache
+    const sessionId = Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, '0')).join('');
     // Utility function for stable JSON stringification
     function stableJSONStringify(obj) {
         if (typeof JSONStringify !== 'undefined') {
@@ -50,24 +53,46 @@ $(document).ready(function() {
         metricsDiv.appendChild(line3);
     }
 
-    async function streamResponse(message, botId, containerId) {
+    // Chat containers of the bots, by bot_id
+    const containerIds = {1: 'chat-output-without-rag', 2: 'chat-output-with-rag'};
+
+    function appendStreamMetrics(metrics, botId) {
+        const metricsDiv = document.getElementById('metrics' + botId);
+        const line = document.createElement('div');
+        const ttft = metrics.time_to_first_token_ms !== null ? metrics.time_to_first_token_ms.toFixed(0) + " ms" : "n/a";
+        const tps = metrics.tokens_per_second !== null ? metrics.tokens_per_second.toFixed(2) : "n/a";
+        line.textContent = "Time to first token: " + ttft + " | Tokens/s: " + tps;
+        metricsDiv.appendChild(line);
+    }
+
+    // Queries both models with a single request; the answers arrive interleaved as NDJSON
+    // lines tagged with their bot_id
+    async function streamBoth(message) {
         try {
             // Use JSONStringify for stable key ordering
             const payload = stableJSONStringify({
-                message: message,
-                bot_id: botId
+                message: message
             });
 
-            const response = await fetch('/stream', {
+            const response = await fetch('/stream_both', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
-                    'X-CSRFToken': csrfToken
+                    'X-CSRFToken': csrfToken,
+                    'X-Session-Id': sessionId
                 },
                 body: payload
             });
 
-            const container = document.getElementById(containerId);
+            // The server rejects requests when the models are saturated
+            if (response.status === 429 || response.status === 503) {
+                const retryAfter = response.headers.get('Retry-After') || '1';
+                for (const containerId of Object.values(containerIds)) {
+                    appendToChat('\nThe model is busy, please retry in ' + retryAfter + ' seconds\n', containerId);
+                }
+                return;
+            }
+
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
             let buffer = '';
@@ -80,23 +105,37 @@ $(document).ready(function() {
 
                 for (let i = 0; i < lines.length - 1; i++) {
                     const line = lines[i].trim();
-                    if (line.startsWith('data: ')) {
-                        try {
-                            // Parse the incoming JSON data
-                            const jsonStr = line.slice(6);
-                            const data = JSON.parse(jsonStr);
-
-                            if (data.content) {
-                                appendToChat(data.content, containerId);
-                            }
-                            if (data.timings) {
-                                updateMetrics(data.timings, botId);
-                                container.scrollTop = container.scrollHeight;
-                                return;
+                    if (!line) continue;
+                    try {
+                        const event = JSON.parse(line);
+
+                        // Errors of the relay itself are not tagged with a bot_id
+                        if (event.error) {
+                            for (const containerId of Object.values(containerIds)) {
+                                appendToChat('\nError: ' + event.error + '\n', containerId);
                             }
-                        } catch (e) {
-                            console.error('Error parsing JSON:', e);
+                            continue;
                         }
+
+                        const containerId = containerIds[event.bot_id];
+
+                        if (event.metrics) {
+                            appendStreamMetrics(event.metrics, event.bot_id);
+                            continue;
+                        }
+
+                        const data = event.data || {};
+                        if (data.content) {
+                            appendToChat(data.content, containerId);
+                        }
+                        if (data.error) {
+                            appendToChat('\nError: ' + data.error + '\n', containerId);
+                        }
+                        if (data.timings) {
+                            await updateMetrics(data.timings, event.bot_id);
+                        }
+                    } catch (e) {
+                        console.error('Error parsing JSON:', e);
                     }
                 }
                 buffer = lines[lines.length - 1];
@@ -105,7 +144,9 @@ $(document).ready(function() {
             }
         } catch (error) {
             console.error('Stream error:', error);
-            appendToChat('\nError: Failed to get response\n', containerId);
+            for (const containerId of Object.values(containerIds)) {
+                appendToChat('\nError: Failed to get response\n', containerId);
+            }
         }
     }
 
@@ -120,16 +161,8 @@ $(document).ready(function() {
             appendToChat("You: " + message + "\n", 'chat-output-without-rag');
             appendToChat("You: " + message + "\n", 'chat-output-with-rag');
 
-            // Create both stream promises
-            const stream1 = streamResponse(message, 1, 'chat-output-without-rag');
-            const stream2 = streamResponse(message, 2, 'chat-output-with-rag');
-
-            // Execute both streams in parallel and handle errors independently
-            try {
-                await Promise.allSettled([stream1, stream2]);
-            } catch (error) {
-                console.error('Error in parallel execution:', error);
-            }
+            // Both models answer in parallel over a single request
+            await streamBoth(message);
 
             userInput.value = '';
         }
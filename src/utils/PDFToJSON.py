@@ -3,13 +3,57 @@
 #
 import json
 from pypdf import PdfReader
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterator, Tuple
 import logging
 from datetime import datetime
+import os
 import re
 from pathlib import Path
 
 
+class JSONPageWriter:
+    """
+    Writes the JSON document of a PDF one page at a time, so the whole document is never
+    held in memory. The file is written under a temporary name and only moved into place
+    once complete, so a failed conversion does not leave a truncated JSON file behind.
+    """
+
+    def __init__(self, json_path: Path, header: Dict[str, Any]):
+        """
+        Initialize the writer and write the document fields preceding the pages.
+
+        Args:
+            json_path (Path): Path of the JSON file
+            header (Dict[str, Any]): Fields of the document other than the pages
+        """
+        self.json_path = Path(json_path)
+        self.temp_path = self.json_path.with_name(self.json_path.name + ".tmp")
+        self.file = open(self.temp_path, "w", encoding="utf-8")
+        self.pages_written = 0
+
+        # The header object is left open and continued with the pages object
+        self.file.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "pages": {')
+
+    def write_page(self, page_num: int, page: Dict[str, Any]) -> None:
+        separator = ", " if self.pages_written else ""
+        self.file.write(
+            f'{separator}"{page_num}": {json.dumps(page, ensure_ascii=False)}'
+        )
+        self.pages_written += 1
+
+    def close(self) -> None:
+        """Complete the document and move it into place."""
+        self.file.write("}}\n")
+        self.file.close()
+        os.replace(self.temp_path, self.json_path)
+
+    def abort(self) -> None:
+        """Discard the partial document."""
+        self.file.close()
+        if self.temp_path.exists():
+            self.temp_path.unlink()
+
+
 class PDFToJSON:
     """A class to handle reading PDF files and converting content to JSON format."""
 
@@ -82,6 +126,42 @@ class PDFToJSON:
 
         return metadata
 
+    def split_paragraphs(self, page_content: str) -> List[str]:
+        """
+        Split raw page content into cleaned paragraphs.
+
+        Paragraphs end at blank lines and at lines that end a sentence while being
+        noticeably shorter than the longest line of their block, the usual shape of the
+        last line of a paragraph in text extracted from a PDF.
+
+        Args:
+            page_content (str): Raw page content
+
+        Returns:
+            List[str]: Cleaned paragraphs
+        """
+        if not page_content:
+            return []
+
+        paragraphs = []
+        for block in re.split(r"\n\s*\n", page_content):
+            lines = [line.strip() for line in block.split("\n") if line.strip()]
+            if not lines:
+                continue
+
+            width = max(len(line) for line in lines)
+            current = []
+            for line in lines:
+                current.append(line)
+                if line[-1] in ".!?:" and len(line) < 0.8 * width:
+                    paragraphs.append(" ".join(current))
+                    current = []
+            if current:
+                paragraphs.append(" ".join(current))
+
+        cleaned = (self.clean_text(paragraph) for paragraph in paragraphs)
+        return [paragraph for paragraph in cleaned if paragraph]
+
     def process_page_content(self, page_content: str) -> Dict[str, Any]:
         """
         Process and structure page content.
@@ -90,12 +170,11 @@ class PDFToJSON:
             page_content (str): Raw page content
 
         Returns:
-            Dict[str, Any]: Structured page content
+            Dict[str, Any]: Structured page content, with the paragraphs of full_text
+                separated by a blank line
         """
-        cleaned_text = self.clean_text(page_content)
-
-        # Split content into paragraphs (simple approach)
-        paragraphs = [p.strip() for p in cleaned_text.split("\n\n") if p.strip()]
+        paragraphs = self.split_paragraphs(page_content)
+        cleaned_text = "\n\n".join(paragraphs)
 
         # Basic content analysis
         word_count = len(cleaned_text.split())
@@ -107,10 +186,58 @@ class PDFToJSON:
             "statistics": {"word_count": word_count, "character_count": char_count},
         }
 
+    def iter_pages(
+        self, pdf_path: Path, json_path: Path = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Lazily extract and process the pages of a PDF file, one page at a time.
+
+        Args:
+            pdf_path (Path): Path to the PDF file
+            json_path (Path): Optional path the JSON document of the PDF is written to,
+                page by page as the pages are yielded
+
+        Yields:
+            Tuple[int, Dict[str, Any]]: Page number (starting at 1) and structured page content
+        """
+        with open(pdf_path, "rb") as file:
+            pdf_reader = PdfReader(file)
+
+            writer = None
+            if json_path:
+                writer = JSONPageWriter(
+                    json_path,
+                    {
+                        "filename": str(pdf_path),
+                        "conversion_timestamp": datetime.now().isoformat(),
+                        "total_pages": len(pdf_reader.pages),
+                        "metadata": self.extract_metadata(pdf_reader),
+                    },
+                )
+
+            try:
+                for page_num, page in enumerate(pdf_reader.pages, 1):
+                    page_content = self.process_page_content(page.extract_text())
+                    if writer is not None:
+                        writer.write_page(page_num, page_content)
+                    yield page_num, page_content
+
+                if writer is not None:
+                    writer.close()
+                    self.logger.info(f"Successfully saved JSON: {json_path}")
+                    writer = None
+            finally:
+                # The pages were not all written: an error or the consumer stopped early
+                if writer is not None:
+                    writer.abort()
+
     def convert_pdf_to_json(self, pdf_path: Path) -> Dict[str, Any]:
         """
         Convert a single PDF file to JSON format.
 
+        Holds the content of every page in memory; use iter_pages to process or save
+        large PDF files page by page.
+
         Args:
             pdf_path (Path): Path to the PDF file
 
@@ -123,7 +250,7 @@ class PDFToJSON:
 
                 # Initialize the JSON structure
                 pdf_data = {
-                    "filename": pdf_path,
+                    "filename": str(pdf_path),
                     "conversion_timestamp": datetime.now().isoformat(),
                     "total_pages": len(pdf_reader.pages),
                     "metadata": self.extract_metadata(pdf_reader),
@@ -171,6 +298,10 @@ class PDFToJSON:
 
         for pdf_file in pdf_files:
             self.logger.info(f"Processing {pdf_file.name}")
-            json_data = self.convert_pdf_to_json(pdf_file)
-            if json_data:
-                self.save_json(json_data, pdf_file.name)
+            json_path = self.output_folder / f"{pdf_file.name[:-4]}.json"
+            try:
+                # Each page is written as soon as it is extracted
+                for _ in self.iter_pages(pdf_file, json_path):
+                    pass
+            except Exception as e:
+                self.logger.error(f"Error processing PDF {pdf_file}: {str(e)}")
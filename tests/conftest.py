@@ -0,0 +1,8 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+import os
+import sys
+
+# The applications run from src and import the shared modules as common.X
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
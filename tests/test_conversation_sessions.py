@@ -0,0 +1,52 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+from common.ConversationSessions import ConversationStore
+from common.PromptTemplate import PromptTemplate
+from common.StreamRelay import error_line
+
+SESSION_ID = "session-0001"
+
+
+class FakeTokenCounter:
+    def count(self, text):
+        return len(text.split())
+
+
+def make_store():
+    return ConversationStore(PromptTemplate("Be helpful."), FakeTokenCounter())
+
+
+def test_record_keeps_a_completed_answer():
+    store = make_store()
+    lines = [
+        b'{"content":"Hello","stop":false}\n',
+        b'{"content":" there","stop":false}\n',
+        b'{"content":"","stop":true}\n',
+    ]
+
+    assert list(store.record(SESSION_ID, "Hi", iter(lines))) == lines
+    assert store.history(SESSION_ID) == [("Hi", "Hello there")]
+
+
+def test_record_relays_an_error_line_without_keeping_the_turn():
+    store = make_store()
+    lines = [b'{"content":"Hel","stop":false}\n', error_line("Model server error")]
+
+    assert list(store.record(SESSION_ID, "Hi", iter(lines))) == lines
+    assert store.history(SESSION_ID) == []
+
+
+def test_follow_up_prompt_starts_with_the_previous_prompt():
+    store = make_store()
+    template = store.template
+    prompt = template.render("What is it?", context="Some context.")
+    lines = [b'{"content":"An answer.","stop":true}\n']
+
+    user_turn = template.user_turn("What is it?", "Some context.")
+    list(store.record(SESSION_ID, user_turn, iter(lines)))
+
+    follow_up = template.render(
+        "And then?", context="Other context.", history=store.history(SESSION_ID)
+    )
+    assert follow_up.startswith(prompt + "An answer.")
@@ -0,0 +1,43 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+import os
+
+import numpy as np
+
+from common.LocalVectorStore import BruteForceVectorStore, LocalVectorStore
+
+DIMENSION = 8
+ROWS = 64
+
+
+def write_config(tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_text(
+        "[VectorStore]\n"
+        f"LocalPath = {tmp_path / 'vector_store'}\n"
+        f"Dimension = {DIMENSION}\n"
+        "IVFMinRows = 16\n"
+        "IVFProbes = 1\n"
+    )
+    return str(path)
+
+
+def test_exact_backend_ignores_trained_centroids(tmp_path):
+    configfile_name = write_config(tmp_path)
+    embeddings = np.random.default_rng(0).normal(size=(ROWS, DIMENSION))
+
+    ivf = LocalVectorStore(configfile_name)
+    ivf.insert_many([f"chunk {i}" for i in range(ROWS)], embeddings)
+    ivf.maybe_train()
+    assert ivf.lists is not None
+    assert os.path.exists(ivf.centroids_path)
+
+    exact = BruteForceVectorStore(configfile_name)
+    assert exact.lists is None
+    assert exact.centroids is None
+    assert len(exact.rows) == ROWS
+
+    # Every row is its own nearest neighbour when every row is scanned
+    results = exact.search_similar_texts_batch(embeddings, 1, -1.0)
+    assert [result[0][0] for result in results] == [f"chunk {i}" for i in range(ROWS)]
@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+import os
+
+import gevent
+import numpy as np
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("boto3")
+
+from common.VectorDatabase import VectorDatabase  # noqa: E402
+
+# Connection string of a scratch PostgreSQL database with the pgvector extension
+DSN = os.environ.get("PGVECTOR_TEST_DSN")
+
+pytestmark = pytest.mark.skipif(not DSN, reason="PGVECTOR_TEST_DSN is not set")
+
+
+@pytest.fixture
+def vector_database(tmp_path):
+    config = tmp_path / "config.ini"
+    config.write_text(
+        "[RDS_Connection]\n"
+        "secret_name = test\n"
+        "region_name = test\n"
+        "db_name = test\n"
+        "host = localhost\n"
+        "port = 5432\n"
+        "SecretTTL = 3600\n"
+        "PoolMinSize = 1\n"
+        "PoolMaxSize = 2\n"
+        "PoolAcquireTimeout = 10\n"
+        "PoolIdleTimeout = 300\n"
+        "PoolHealthCheckInterval = 30\n"
+    )
+    database = VectorDatabase(str(config))
+    # Connect to the scratch database instead of fetching credentials from Secrets Manager
+    database.get_credentials = lambda refresh=False: psycopg2.extensions.parse_dsn(DSN)
+    database.create_vector_table()
+
+    yield database
+
+    database.pool.evictor.kill()
+    database.pool.close_all()
+
+
+def stored_texts(database, ids):
+    with database.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, text FROM text_embeddings WHERE id = ANY(%s);", (ids,)
+            )
+            texts = dict(cur.fetchall())
+            cur.execute("DELETE FROM text_embeddings WHERE id = ANY(%s);", (ids,))
+        conn.commit()
+    return [texts.get(i) for i in ids]
+
+
+def test_insert_many_returns_ids_in_input_order(vector_database):
+    rng = np.random.default_rng(0)
+
+    # The pooled connections run with the gevent wait callback installed; the second
+    # insert reuses the connection and its staging table
+    for batch in range(2):
+        texts = [f"chunk {batch}-{i}" for i in range(5)]
+        locations = [(1, 1, 10 * i, 10 * i + 9) for i in range(5)]
+        ids = gevent.spawn(
+            vector_database.insert_many,
+            texts,
+            rng.normal(size=(len(texts), 384)),
+            page_size=2,
+            source="test.pdf",
+            chunk_hashes=[f"{i:064d}" for i in range(5)],
+            locations=locations,
+        ).get()
+
+        assert psycopg2.extensions.get_wait_callback() is not None
+        assert stored_texts(vector_database, ids) == texts